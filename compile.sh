@@ -9,6 +9,13 @@ set -x
 # TODO: restore contrail-tor-agent
 
 SCONS_OPT=${SCONS_OPT:-production}
+# debug info: full, split (.dwo files, packed in .dwp files) or none
+# (scons default if empty: full, or none with CONTRAIL_COMPILE_WITHOUT_SYMBOLS)
+SCONS_DEBUG_INFO=${SCONS_DEBUG_INFO:-}
+# linker: bfd, gold, lld or mold (compiler default if empty)
+SCONS_LINKER=${SCONS_LINKER:-}
+# set to 'true' to limit parallel jobs by the memory they are expected to use
+SCONS_MEMORY_AWARE_JOBS=${SCONS_MEMORY_AWARE_JOBS:-false}
 
 # folder with built binaries/libs/docs/data/... files from tf-dev-sandbox container
 export BUILD_ROOT=${BUILD_ROOT:-'/buildroot'}
@@ -33,11 +40,23 @@ mkdir -p ${BUILD_ROOT}/usr/src/contrail/contrail-web-controller/ ${BUILD_ROOT}/u
 pushd $src_root/
 build_jobs=$(nproc --ignore=1)
 build_number=$(date +%Y%m%d%H%M)
+scons_link_opts=""
+if [[ -n "$SCONS_DEBUG_INFO" ]]; then
+    scons_link_opts+=" --debug-info=$SCONS_DEBUG_INFO"
+fi
+if [[ -n "$SCONS_LINKER" ]]; then
+    scons_link_opts+=" --linker=$SCONS_LINKER"
+fi
+scons_job_opts=""
+if [[ "${SCONS_MEMORY_AWARE_JOBS^^}" == 'TRUE' ]]; then
+    scons_job_opts="--memory-aware-jobs"
+fi
 # compile and pack most components
-scons -j "$build_jobs" --opt=$SCONS_OPT --root=${BUILD_ROOT} --without-dpdk --build-number="$build_number" install
+scons -j "$build_jobs" $scons_job_opts --opt=$SCONS_OPT $scons_link_opts --root=${BUILD_ROOT} --without-dpdk --build-number="$build_number" install
 # dpdk stuff
 scons \
     --opt=$SCONS_OPT \
+    $scons_link_opts \
     -j "$build_jobs" \
     --build-number="$build_number" \
     --dpdk-jobs="$build_jobs" \
@@ -109,6 +128,10 @@ if [[ ${DEBUGINFO^^} == 'TRUE' ]]; then
     fi
     mkdir -p ${DEBUGINFO_ROOT}/$(dirname $ff)
     objcopy --only-keep-debug $ff ${DEBUGINFO_ROOT}/$ff.dbg
+    # with split debug info, pack the .dwo files the binary refers to
+    if [[ "$SCONS_DEBUG_INFO" == 'split' ]] && readelf -S $ff | grep -q '\.debug_addr' ; then
+      (cd $src_root && dwp -e ${BUILD_ROOT}/$ff -o ${DEBUGINFO_ROOT}/$ff.dwp)
+    fi
   done
 fi
 
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+
+#
+# Copyright (c) 2026 OpenSDN authors. Licensed under the Apache License,
+# Version 2.0, see LICENSE.
+#
+
+# Compiler cache used by rules.py with --compiler-cache.
+#
+# usage: compiler_cache.py --dir DIR [--stats FILE] -- COMPILER ARGS...
+#
+# Compilations of a single source file to an object file (-c) are looked
+# up in DIR by a hash of the compiler binary, the arguments (but the
+# object file name), the preprocessed source and, for debug builds, the
+# working directory, which is recorded in the debug information. On a
+# hit the object file and the compiler diagnostics are restored from the
+# cache; on a miss the compiler runs and its output is stored. With
+# -gsplit-dwarf, the .dwo file is cached along with the object, and the
+# object file name is part of the key, as the object refers to its .dwo
+# by name. A depfile requested with -MD or -MMD is written by the
+# preprocessor run computing the key, so it is there on hits as well.
+# Other invocations, and compilations producing outputs the cache does
+# not know about (coverage notes, profile data), run the compiler
+# unchanged.
+#
+# A line 'hit' or 'miss' is appended to the stats file for every cached
+# compilation, and a line 'stored SIZE' for every entry stored. Eviction
+# is done by rules.py at the end of the build.
+
+import hashlib
+import os
+import shutil
+import subprocess
+import sys
+
+
+# Options after which the next argument is not a source file.
+_ARG_OPTIONS = set([
+    '-o', '-I', '-D', '-U', '-include', '-imacros', '-isystem', '-iquote',
+    '-idirafter', '-isysroot', '-x', '-MF', '-MT', '-MQ', '-Xlinker',
+    '-Xassembler', '-Xpreprocessor', '--param', '-aux-info', '-dumpbase',
+    '-dumpdir',
+])
+
+# Options with outputs or inputs besides the object file, not cached.
+_UNCACHEABLE = (
+    '--coverage', '-fprofile-arcs', '-ftest-coverage', '-fprofile-generate',
+    '-fprofile-use', '-fauto-profile', '-save-temps', '-fdump-',
+)
+_UNCACHEABLE_EXACT = set(['-M', '-MM', '-E', '-S'])
+
+# Depfile options, their arguments are not part of the key.
+_DEPFILE_OPTIONS = set(['-MF', '-MT', '-MQ'])
+
+_SOURCE_SUFFIXES = ('.c', '.cc', '.cpp', '.cxx', '.c++', '.C', '.s', '.S')
+
+
+def parse(args):
+    """Return (source, output) of a cacheable compilation, else None."""
+    if '-c' not in args:
+        return None
+    source = output = None
+    skip = False
+    for i, arg in enumerate(args):
+        if skip:
+            skip = False
+            continue
+        if arg.startswith(_UNCACHEABLE) or arg in _UNCACHEABLE_EXACT:
+            return None
+        if arg == '-o':
+            output = args[i + 1] if i + 1 < len(args) else None
+        if arg in _ARG_OPTIONS:
+            skip = True
+        elif not arg.startswith('-') and arg.endswith(_SOURCE_SUFFIXES):
+            if source:
+                return None
+            source = arg
+    if not source or not output:
+        return None
+    return source, output
+
+
+def dwo_file(args, output):
+    """Return the .dwo file written with -gsplit-dwarf, else None."""
+    if '-gsplit-dwarf' not in args:
+        return None
+    if '-dumpbase' in args:
+        i = args.index('-dumpbase')
+        if i + 1 < len(args):
+            return args[i + 1] + '.dwo'
+    return os.path.splitext(output)[0] + '.dwo'
+
+
+def compiler_id(compiler):
+    path = shutil.which(compiler) or compiler
+    st = os.stat(os.path.realpath(path))
+    return '%s:%d:%d' % (os.path.realpath(path), st.st_size, st.st_mtime_ns)
+
+
+def cache_key(compiler, args, output):
+    cpp_args = []
+    skip = False
+    for i, arg in enumerate(args):
+        if skip:
+            skip = False
+        elif arg == '-o':
+            skip = True
+        elif arg == '-c':
+            cpp_args.append('-E')
+        else:
+            cpp_args.append(arg)
+    if '-MD' in args or '-MMD' in args:
+        # write the depfile the compilation would write
+        if '-MF' not in args:
+            cpp_args += ['-MF', os.path.splitext(output)[0] + '.d']
+        if not set(['-MT', '-MQ']) & set(args):
+            cpp_args += ['-MT', output]
+    proc = subprocess.run([compiler] + cpp_args, stdout=subprocess.PIPE,
+                          stderr=subprocess.DEVNULL)
+    if proc.returncode != 0:
+        return None
+
+    h = hashlib.sha256()
+    h.update(compiler_id(compiler).encode() + b'\0')
+    split = '-gsplit-dwarf' in args
+    skip = False
+    for arg in args:
+        if skip:
+            skip = False
+        elif arg in _DEPFILE_OPTIONS:
+            skip = True
+        elif arg != output or split:
+            h.update(arg.encode() + b'\0')
+    if any(a.startswith('-g') and a != '-g0' for a in args):
+        h.update(os.getcwd().encode() + b'\0')
+    h.update(proc.stdout)
+    return h.hexdigest()
+
+
+def record(stats, result):
+    if stats:
+        with open(stats, 'a') as f:
+            f.write(result + '\n')
+
+
+def main(argv):
+    cache_dir = stats = None
+    while argv and argv[0] != '--':
+        opt = argv.pop(0)
+        if opt == '--dir':
+            cache_dir = argv.pop(0)
+        elif opt == '--stats':
+            stats = argv.pop(0)
+    cmd = argv[1:]
+    if not cache_dir or not cmd:
+        sys.stderr.write('usage: compiler_cache.py --dir DIR [--stats FILE] -- COMPILER ARGS...\n')
+        return 2
+
+    compiler, args = cmd[0], cmd[1:]
+    parsed = parse(args)
+    key = cache_key(compiler, args, parsed[1]) if parsed else None
+    if key is None:
+        return subprocess.call(cmd)
+    output = parsed[1]
+    outputs = [('obj', output)]
+    dwo = dwo_file(args, output)
+    if dwo:
+        outputs.append(('dwo', dwo))
+
+    entry = os.path.join(cache_dir, key[:2], key)
+    try:
+        for name, path in outputs:
+            tmp = '%s.%d.tmp' % (path, os.getpid())
+            shutil.copyfile(os.path.join(entry, name), tmp)
+            os.replace(tmp, path)
+        with open(os.path.join(entry, 'stderr'), 'rb') as f:
+            sys.stderr.buffer.write(f.read())
+        os.utime(entry)
+        record(stats, 'hit')
+        return 0
+    except OSError:
+        pass
+
+    record(stats, 'miss')
+    proc = subprocess.run(cmd, stderr=subprocess.PIPE)
+    sys.stderr.buffer.write(proc.stderr)
+    if proc.returncode != 0:
+        return proc.returncode
+    tmp = '%s.%d.tmp' % (entry, os.getpid())
+    try:
+        os.makedirs(tmp)
+        for name, path in outputs:
+            shutil.copyfile(path, os.path.join(tmp, name))
+        with open(os.path.join(tmp, 'stderr'), 'wb') as f:
+            f.write(proc.stderr)
+        size = sum(os.path.getsize(os.path.join(tmp, f)) for f in os.listdir(tmp))
+        os.rename(tmp, entry)
+    except OSError:
+        # another build stored the same entry meanwhile
+        shutil.rmtree(tmp, ignore_errors=True)
+        return 0
+    record(stats, 'stored %d' % size)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
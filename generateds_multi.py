@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+
+#
+# Copyright (c) 2026 OpenSDN authors. Licensed under the Apache License,
+# Version 2.0, see LICENSE.
+#
+
+# Run generateDS.py several times in a single process.
+#
+# usage: generateds_multi.py GENERATEDS ARGS [-- ARGS ...]
+#
+# GENERATEDS is loaded (and its modules imported) once. Every argument
+# list is then run in a forked copy of this warm process, so runs pay
+# neither interpreter startup nor module loading, and cannot affect each
+# other through generateDS global state.
+
+import os
+import sys
+import traceback
+
+
+def split_runs(args):
+    runs = [[]]
+    for arg in args:
+        if arg == '--':
+            runs.append([])
+        else:
+            runs[-1].append(arg)
+    return [run for run in runs if run]
+
+
+def run(script, code, module, args):
+    sys.argv = [script] + args
+    try:
+        if callable(module.get('main')):
+            module['main']()
+        else:
+            exec(code, {'__name__': '__main__', '__file__': script})
+        status = 0
+    except SystemExit as e:
+        if e.code is None or isinstance(e.code, int):
+            status = e.code or 0
+        else:
+            sys.stderr.write('%s\n' % e.code)
+            status = 1
+    except BaseException:
+        traceback.print_exc()
+        status = 1
+    sys.stdout.flush()
+    sys.stderr.flush()
+    return status
+
+
+def main(argv):
+    if len(argv) < 3:
+        sys.stderr.write('usage: %s GENERATEDS ARGS [-- ARGS ...]\n' % argv[0])
+        return 2
+    script = os.path.abspath(argv[1])
+    sys.path.insert(0, os.path.dirname(script))
+    with open(script) as f:
+        code = compile(f.read(), script, 'exec')
+    module = {'__name__': 'generateDS', '__file__': script}
+    exec(code, module)
+
+    failed = 0
+    for args in split_runs(argv[2:]):
+        sys.stdout.flush()
+        sys.stderr.flush()
+        pid = os.fork()
+        if pid == 0:
+            os._exit(run(script, code, module, args))
+        _, status = os.waitpid(pid, 0)
+        if os.waitstatus_to_exitcode(status):
+            sys.stderr.write('generateDS failed: %s\n' % ' '.join(args))
+            failed = 1
+    return failed
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+
+#
+# Copyright (c) 2026 OpenSDN authors. Licensed under the Apache License,
+# Version 2.0, see LICENSE.
+#
+
+# Run a command and report its peak resident set size.
+#
+# usage: peak_rss.py FILE -- COMMAND ARGS...
+#
+# The peak RSS, in kilobytes, of COMMAND and of the processes it waited
+# for is written to FILE. Linux accounts the memory of the forking
+# process to the peak RSS of a child, so measuring a command forked from
+# SCons reports the size of SCons; this small process forks it instead.
+# The exit status of COMMAND is returned, and a signal which terminated
+# it is raised again.
+
+import os
+import signal
+import sys
+
+
+def main(argv):
+    if len(argv) < 3 or argv[1] != '--':
+        sys.stderr.write('usage: peak_rss.py FILE -- COMMAND ARGS...\n')
+        return 2
+    path, cmd = argv[0], argv[2:]
+    try:
+        pid = os.fork()
+    except OSError as e:
+        sys.stderr.write('peak_rss.py: %s\n' % e)
+        return 1
+    if pid == 0:
+        try:
+            os.execvp(cmd[0], cmd)
+        except OSError as e:
+            sys.stderr.write('%s: %s\n' % (cmd[0], e.strerror))
+            os._exit(127)
+
+    # signals sent to this process are meant for the command
+    for sig in (signal.SIGINT, signal.SIGTERM, signal.SIGHUP):
+        signal.signal(sig, lambda sig, frame: os.kill(pid, sig))
+    _, status, rusage = os.wait4(pid, 0)
+    with open(path, 'w') as f:
+        f.write('%d\n' % rusage.ru_maxrss)
+
+    if os.WIFSIGNALED(status):
+        sig = os.WTERMSIG(status)
+        if sig != signal.SIGKILL:
+            signal.signal(sig, signal.SIG_DFL)
+        os.kill(os.getpid(), sig)
+    return os.waitstatus_to_exitcode(status)
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,48 @@
+#!/bin/bash
+set -e; set -o pipefail
+[ "${DEBUG^^}" != 'TRUE' ] || set -x
+
+# Profile-guided optimized build (scons --opt=pgo), in build/pgo.
+#
+# usage: pgo.sh [TARGET...]            (default target: install)
+#
+# 1. builds instrumented binaries and runs the training workload, the
+#    PGO_TRAIN scons targets (default: the 'test' alias of the unit tests),
+#    which writes profiles to build/pgo-profile;
+# 2. merges in the profiles of other training runs, if any (PGO_PROFILES,
+#    a list of directories, e.g. collected from a test bed);
+# 3. rebuilds TARGET with the profiles, and with LTO if PGO_LTO=true.
+# Extra scons options can be given in SCONS_OPTS.
+
+my_dir=$(realpath $(dirname "$0"))
+src_root=$(dirname $(dirname "$my_dir"))
+profile_dir=$src_root/build/pgo-profile
+
+targets=${@:-install}
+build_jobs=$(nproc --ignore=1)
+scons_opts="-j $build_jobs --opt=pgo $SCONS_OPTS"
+if [[ "${PGO_LTO^^}" == 'TRUE' ]]; then
+    scons_opts+=" --lto"
+fi
+
+pushd $src_root/
+rm -rf $profile_dir
+
+# training: failing tests still leave usable profiles
+if ! scons -k $scons_opts --pgo-phase=generate ${PGO_TRAIN:-test} ; then
+    echo "WARNING: training workload had failures, using the profiles collected"
+fi
+
+for dir in $PGO_PROFILES ; do
+    gcov-tool merge -o $profile_dir.merged $profile_dir $dir
+    rm -rf $profile_dir
+    mv $profile_dir.merged $profile_dir
+done
+
+if [[ -z "$(find $profile_dir -name '*.gcda' 2>/dev/null | head -1)" ]]; then
+    echo "ERROR: no profiles in $profile_dir"
+    exit 1
+fi
+
+scons $scons_opts --pgo-phase=use $targets
+popd
@@ -2,28 +2,42 @@
 # Copyright (c) 2013 Juniper Networks, Inc. All rights reserved.
 #
 
+import atexit
+import collections.abc
+import concurrent.futures
+import contextlib
+import hashlib
 import json
+import math
+import mmap
 import os
 import re
+from xml.etree import ElementTree
 from SCons.Builder import Builder
 from SCons.Action import Action
 from SCons.Errors import convert_to_BuildError, BuildError
 from SCons.Script import AddOption, GetOption, SetOption
 from SCons.Node import Alias
 from distutils.spawn import find_executable
+import SCons.Script.Main
+import SCons.Tool
 import SCons.Util
 import subprocess
 import datetime
+import filecmp
+import fnmatch
+import glob
 import time
+import signal
+import sys
+import threading
 import platform
 import getpass
+import shutil
+import tempfile
 import multiprocessing
 
 
-# treat this as a sigletone
-_build_number = datetime.datetime.utcnow().strftime("%Y%m%d%H%M")
-
-
 if hasattr(SCons.Warnings, "Warning"):
     # scons 3.x
     class SandeshWarning(SCons.Warnings.Warning):
@@ -38,29 +52,61 @@ class SandeshCodeGeneratorError(SandeshWarning):
     pass
 
 
-def GetTestEnvironment(test):
-    env = {}
+# Unit test environment overrides are read from ci_unittests.json only once
+# per scons run. All test patterns of an entry are compiled into a single
+# regex, and the resulting environment is memoized per test.
+_test_env_index = None
+_test_env_cache = {}
+_test_env_lock = threading.Lock()
+# bytes stored in the unit test result cache by this build
+_test_cache_added = 0
+_test_cache_lock = threading.Lock()
+
+
+def LoadTestEnvironmentIndex(path='controller/ci_unittests.json'):
+    index = []
+    if not os.path.exists(path):
+        return index
     try:
-        with open('controller/ci_unittests.json') as json_file:
+        with open(path) as json_file:
             d = json.load(json_file)
-            for e in d["contrail-control"]["environment"]:
-                for t in e["tests"]:
-                    if re.compile(t).match(test):
-                        for tup in e["tuples"]:
-                            tokens = tup.split("=")
-                            env[tokens[0]] = tokens[1]
-    except Exception:
-        pass
+        for e in d["contrail-control"]["environment"]:
+            pattern = re.compile('|'.join('(?:%s)' % t for t in e["tests"]))
+            tuples = {}
+            for tup in e["tuples"]:
+                tokens = tup.split("=")
+                tuples[tokens[0]] = tokens[1]
+            index.append((pattern, tuples))
+    except (OSError, ValueError, LookupError, TypeError, re.error) as e:
+        print('scons: warning: failed to parse %s: %s' % (path, e))
+    return index
+
+
+def GetTestEnvironment(test):
+    global _test_env_index
+    with _test_env_lock:
+        if test in _test_env_cache:
+            return _test_env_cache[test]
+        if _test_env_index is None:
+            _test_env_index = LoadTestEnvironmentIndex()
+        env = {}
+        for pattern, tuples in _test_env_index:
+            if pattern.match(test):
+                env.update(tuples)
+        _test_env_cache[test] = env
     return env
 
 
 def RunUnitTest(env, target, source, timeout=300):
+    timings = getattr(env, 'test_timings', None)
+    shards = int(env['ENV'].get('GTEST_TOTAL_SHARDS', 1))
     if 'CONTRAIL_UT_TEST_TIMEOUT' in env['ENV']:
         timeout = int(env['ENV']['CONTRAIL_UT_TEST_TIMEOUT'])
+    elif timings:
+        timeout = timings.timeout(source[0].path, timeout, shards)
 
     test = str(source[0].abspath)
-    logfile = open(target[0].abspath, 'w')
-    tgt = target[0].name
+    tgt = source[0].name + '.log'
     if '_venv' in env and tgt in env['_venv'] and env['_venv'][tgt]:
         cmd = ['/bin/bash', '-c', 'source %s/bin/activate && %s' % (
                env[env['_venv'][tgt]]._path, test)]
@@ -68,7 +114,7 @@ def RunUnitTest(env, target, source, timeout=300):
         cmd = [test]
 
     ShEnv = env['ENV'].copy()
-    ShEnv.update({env['ENV_SHLIB_PATH']: 'build/lib',
+    ShEnv.update({env['ENV_SHLIB_PATH']: env.Dir(env['TOP_LIB']).path,
                   'DB_ITERATION_TO_YIELD': '1',
                   'TOP_OBJECT_PATH': env['TOP'][1:]})
 
@@ -80,23 +126,63 @@ def RunUnitTest(env, target, source, timeout=300):
 
     if 'CONCURRENCY_CHECK_ENABLE' not in ShEnv:
         ShEnv['CONCURRENCY_CHECK_ENABLE'] = 'true'
-    proc = subprocess.Popen(cmd, stdout=logfile, stderr=logfile, env=ShEnv)
 
-    # 60 second timeout
-    for i in range(timeout):
-        code = proc.poll()
-        if code is not None:
-            break
-        time.sleep(1)
+    xml_path = None
+    if ShEnv.get('GTEST_OUTPUT', '').startswith('xml:'):
+        xml_path = ShEnv['GTEST_OUTPUT'][4:]
+
+    signature = None
+    if GetOption('cache_test_results'):
+        cache_dir = env.Dir('#build/test-cache').abspath
+        signature = GetUnitTestSignature(env, source[0], cmd, ShEnv)
+        if RestoreUnitTestResult(cache_dir, signature, target[0].abspath, xml_path):
+            print(test + '\033[94m' + " PASS (cached)" + '\033[0m')
+            return
+
+    logfile = open(target[0].abspath, 'w')
+    # a report left by a previous run must not pass for this one's
+    if xml_path and os.path.exists(xml_path):
+        os.remove(xml_path)
+
+    # Run the test in its own session, so that on timeout we can kill
+    # every helper process it spawned, not only the test itself.
+    rss_path = Basename(target[0].abspath) + '.rss'
+    start_time = time.monotonic()
+    proc = subprocess.Popen(PeakRssCommand(cmd, rss_path), stdout=logfile,
+                            stderr=logfile, env=ShEnv, start_new_session=True)
+    code, rusage = WaitForUnitTest(proc, timeout)
+    max_rss = ReadPeakRss(rss_path)
+    stats = {
+        'test': test,
+        'wall_time': round(time.monotonic() - start_time, 3),
+        'timeout': timeout,
+    }
+    if rusage is not None:
+        stats.update({
+            'user_time': round(rusage.ru_utime, 3),
+            'system_time': round(rusage.ru_stime, 3),
+        })
+    if max_rss is not None:
+        stats['max_rss_kb'] = max_rss
+    stats['status'] = 'TIMEOUT' if code is None else code
+    with open(Basename(target[0].abspath) + '.stats.json', 'w') as stats_file:
+        json.dump(stats, stats_file, indent=2)
 
     if code is None:
-        proc.kill()
         logfile.write('[  TIMEOUT  ] ')
         print(test + '\033[91m' + " TIMEOUT" + '\033[0m')
         raise convert_to_BuildError(code)
         return
 
     if code == 0:
+        # The number of shards is derived from the duration of the whole
+        # test binary; shards add their startup time, so recording their
+        # sum would raise it with every sharded run.
+        if timings and shards == 1:
+            timings.record(source[0].path, stats['wall_time'])
+        if signature:
+            logfile.flush()
+            StoreUnitTestResult(cache_dir, signature, target[0].abspath, xml_path)
         print(test + '\033[94m' + " PASS" + '\033[0m')
     else:
         logfile.write('[  FAILED  ] ')
@@ -108,6 +194,137 @@ def RunUnitTest(env, target, source, timeout=300):
         raise convert_to_BuildError(code)
 
 
+# Command running cmd through peak_rss.py, which writes the peak RSS of
+# cmd, in kilobytes, to path. A child forked from SCons would report the
+# size of SCons instead.
+def PeakRssCommand(cmd, path):
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'peak_rss.py')
+    return [sys.executable, script, path, '--'] + cmd
+
+
+# Return the peak RSS written by peak_rss.py to path, and remove it.
+# None if the command did not run to completion.
+def ReadPeakRss(path):
+    try:
+        with open(path) as f:
+            rss = int(f.read())
+        os.remove(path)
+        return rss
+    except (OSError, ValueError):
+        return None
+
+
+# Variables of the environment SCons runs in which change what a test
+# does. The rest of it (terminal, session, user settings) does not, and
+# is left out of the result signature like everything else inherited.
+UNIT_TEST_INHERITED_ENV = ['PATH', 'LD_LIBRARY_PATH', 'LD_PRELOAD', 'PYTHONPATH']
+
+
+# The result cache of unit tests is keyed by the content of the test
+# binary, the content of the shared libraries it loads from build/lib,
+# its command and the environment variables set for it. A test which
+# passed with the same signature before is not run again, its log and
+# xml report are restored from the cache instead.
+def GetUnitTestSignature(env, test, cmd, ShEnv):
+    test_env = sorted((name, value) for name, value in ShEnv.items()
+                      if name in UNIT_TEST_INHERITED_ENV or os.environ.get(name) != value)
+    h = hashlib.sha256()
+    h.update(test.get_csig().encode())
+    h.update(json.dumps([cmd, test_env]).encode())
+
+    lib_dir = env.Dir(env['TOP_LIB']).abspath + os.sep
+    try:
+        ldd_out = subprocess.check_output(['ldd', test.abspath], env=ShEnv,
+                                          stderr=subprocess.DEVNULL).decode()
+    except (OSError, subprocess.CalledProcessError):
+        # not a dynamic executable, e.g. a script
+        ldd_out = ''
+    libs = set()
+    for line in ldd_out.splitlines():
+        tokens = line.split()
+        if len(tokens) > 2 and tokens[1] == '=>':
+            lib = os.path.abspath(tokens[2])
+            if lib.startswith(lib_dir):
+                libs.add(lib)
+    for lib in sorted(libs):
+        h.update(lib.encode())
+        h.update(env.File(lib).get_csig().encode())
+    return h.hexdigest()
+
+
+def RestoreUnitTestResult(cache_dir, signature, log_path, xml_path):
+    entry = os.path.join(cache_dir, signature[:2], signature)
+    try:
+        # tests which do not use gtest do not write the xml report
+        if xml_path and os.path.exists(os.path.join(entry, 'xml')):
+            shutil.copyfile(os.path.join(entry, 'xml'), xml_path)
+        shutil.copyfile(os.path.join(entry, 'log'), log_path)
+        os.utime(entry)
+    except OSError:
+        return False
+    return True
+
+
+def StoreUnitTestResult(cache_dir, signature, log_path, xml_path):
+    global _test_cache_added
+    entry = os.path.join(cache_dir, signature[:2], signature)
+    tmp = '%s.%d.%d.tmp' % (entry, os.getpid(), threading.get_ident())
+    try:
+        os.makedirs(tmp)
+        shutil.copyfile(log_path, os.path.join(tmp, 'log'))
+        if xml_path and os.path.exists(xml_path):
+            shutil.copyfile(xml_path, os.path.join(tmp, 'xml'))
+        size = DirSize(tmp)
+        os.rename(tmp, entry)
+    except OSError:
+        # a run of the same test stored it meanwhile
+        shutil.rmtree(tmp, ignore_errors=True)
+        return
+    with _test_cache_lock:
+        _test_cache_added += size
+
+
+def TrimUnitTestCache(cache_dir, max_size):
+    TrimCacheDir(cache_dir, max_size, _test_cache_added)
+
+
+# Wait for the unit test process to exit, but not longer than timeout
+# seconds. The child is reaped with wait4() from a helper thread, so we
+# wake up as soon as it exits and get its resource usage as well.
+# On timeout the whole process group of the test is killed.
+# Returns (exit code, rusage), exit code is None on timeout.
+def WaitForUnitTest(proc, timeout):
+    result = {}
+
+    def reap():
+        try:
+            result['wait'] = os.wait4(proc.pid, 0)
+        except ChildProcessError:
+            pass
+
+    waiter = threading.Thread(target=reap)
+    waiter.daemon = True
+    waiter.start()
+    waiter.join(timeout)
+
+    timed_out = waiter.is_alive()
+    if timed_out:
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except OSError:
+            proc.kill()
+        waiter.join()
+
+    if 'wait' not in result:
+        return None, None
+    _, status, rusage = result['wait']
+    # let Popen know the child is already reaped
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    if timed_out:
+        return None, rusage
+    return proc.returncode, rusage
+
+
 def TestSuite(env, target, source):
     if not len(source):
         return None
@@ -119,13 +336,37 @@ def TestSuite(env, target, source):
             skip_list = f.readlines()
         skip_list = [test.strip() for test in skip_list]
 
+    tests = []
     for test in env.Flatten(source):
         # UnitTest() may have tagged tests with skip_run attribute
         if getattr(test.attributes, 'skip_run', False) or test.name in skip_list:
             continue
-
+        tests.append(test)
+
+    # SCons starts the commands of an alias in the order they were added,
+    # so start the tests which took longest in the previous runs first to
+    # shorten the tail of a parallel run. Tests without history go first,
+    # as they may be long as well.
+    timings = getattr(env, 'test_timings', None)
+    if timings:
+        tests.sort(key=lambda test: -timings.get(test.path, float('inf')))
+
+    shard_time = GetOption('shard_tests')
+    for test in tests:
         xml_path = test.abspath + '.xml'
         log_path = test.abspath + '.log'
+
+        shards = 1
+        if shard_time and timings:
+            duration = timings.get(test.path, 0)
+            shards = min(GetOption('num_jobs'), int(math.ceil(duration / shard_time)))
+            if shards > 1 and not IsGTestBinary(test.abspath):
+                shards = 1
+        if shards > 1:
+            cmd = UnitTestShards(env, test, shards)
+            env.Alias(target, cmd)
+            continue
+
         env.tests.add_test(node_path=log_path, xml_path=xml_path, log_path=log_path)
 
         # GTest framework uses environment variables to configure how to write
@@ -141,6 +382,84 @@ def TestSuite(env, target, source):
     return target
 
 
+# Other test binaries ignore GTEST_SHARD_INDEX and would run in full in
+# every shard. gtest reads the variable, so its name is in the binary
+# when gtest is linked statically, as it is in the tree; a binary not
+# built yet is not sharded.
+def IsGTestBinary(path):
+    try:
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            return m.find(b'GTEST_SHARD_INDEX') != -1
+    except (OSError, ValueError):
+        return False
+
+
+# Split a gtest binary into shards run in parallel. Every shard has its
+# own log and xml report, the reports are merged into <test>.xml.
+def UnitTestShards(env, test, shards):
+    shard_cmds = []
+    for index in range(shards):
+        shard_path = '%s.shard%d' % (test.abspath, index)
+        xml_path = shard_path + '.xml'
+        log_path = shard_path + '.log'
+        env.tests.add_test(node_path=log_path, xml_path=xml_path, log_path=log_path)
+
+        isolated_env = env['ENV'].copy()
+        isolated_env['GTEST_OUTPUT'] = 'xml:' + xml_path
+        isolated_env['GTEST_TOTAL_SHARDS'] = str(shards)
+        isolated_env['GTEST_SHARD_INDEX'] = str(index)
+        cmd = env.Command(log_path, test, RunUnitTest, ENV=isolated_env)
+        env.AlwaysBuild(cmd)
+        shard_cmds += cmd
+
+    merged = env.Command(test.abspath + '.xml', shard_cmds,
+                         Action(MergeTestResults, 'MergeTestResults $TARGET'))
+    env.AlwaysBuild(merged)
+    return shard_cmds + merged
+
+
+# Merge the gtest xml reports of the shards. Test suites present in more
+# than one shard are merged into a single testsuite element.
+def MergeTestResults(env, target, source):
+    counters = ['tests', 'failures', 'disabled', 'errors', 'skipped']
+    merged = None
+    suites = {}
+    for log in source:
+        xml_path = Basename(log.abspath) + '.xml'
+        try:
+            root = ElementTree.parse(xml_path).getroot()
+        except (OSError, ElementTree.ParseError) as e:
+            print('scons: warning: no test report %s: %s' % (xml_path, e))
+            continue
+        if merged is None:
+            merged = root
+            suites = dict((s.get('name'), s) for s in root.findall('testsuite'))
+            continue
+        AddTestCounters(merged, root, counters)
+        for suite in root.findall('testsuite'):
+            name = suite.get('name')
+            if name not in suites:
+                merged.append(suite)
+                suites[name] = suite
+                continue
+            AddTestCounters(suites[name], suite, counters)
+            suites[name].extend(list(suite))
+
+    if merged is None:
+        # no shard wrote a report, the shard logs tell what happened
+        merged = ElementTree.Element('testsuites', dict((c, '0') for c in counters))
+    ElementTree.ElementTree(merged).write(target[0].abspath,
+                                          encoding='UTF-8', xml_declaration=True)
+
+
+def AddTestCounters(dst, src, counters):
+    for counter in counters:
+        if src.get(counter) is not None:
+            dst.set(counter, str(int(dst.get(counter, 0)) + int(src.get(counter))))
+    if src.get('time') is not None:
+        dst.set('time', '%.3f' % (float(dst.get('time', 0)) + float(src.get('time'))))
+
+
 # SetupPyTestSuiteWithDeps
 #
 # Function to provide consistent 'tox' interface
@@ -172,25 +491,17 @@ def UnitTest(env, name, sources, **kwargs):
     test_env = env.Clone()
 
     if 'NO_HEAPCHECK' not in env['ENV']:
-        test_env.Append(LIBPATH='#/build/lib')
+        test_env.Append(LIBPATH=env['TOP_LIB'])
         test_env.Append(LIBS=['tcmalloc'])
     return test_env.Program(name, sources)
 
 
-# we are not interested in source files for the dependency, but rather
-# to force rebuilds. Pass an empty source to the env.Command, to break
-# circular dependencies.
-# XXX: This should be rewritten using SCons Value nodes (for generating
-# build info itself) and Builder for managing targets.
+# Build info is generated from a Value node holding its stable part, so
+# that buildinfo.cc, and everything linking it, is only rebuilt when the
+# version, build number, user or host change. See GetBuildInfoStable.
 def GenerateBuildInfoCode(env, target, source, path):
-    o = env.Command(target=target, source=[], action=BuildInfoAction)
-
-    # TODO: re-think this
-    # if we are running under CI or jenkins-driven CB/OB build,
-    # we do NOT want to use AlwaysBuild, as it triggers unnecessary
-    # rebuilds.
-    # if IsAutomatedBuild:
-    env.AlwaysBuild(o)
+    env.Command(target=target, source=env.Value(GetBuildInfoStable(env)),
+                action=BuildInfoAction)
 
 
 # If contrail-controller (i.e., #controller/) is present, determine
@@ -208,7 +519,27 @@ def GetBuildVersion(env):
     return base_ver
 
 
-def GetBuildInfoData(env, target, source):
+# Return the stable build time: SOURCE_DATE_EPOCH if set, else the time
+# of a --build-number in the default YYYYMMDDhhmm format, else None.
+def GetStableBuildTime():
+    epoch = os.environ.get('SOURCE_DATE_EPOCH')
+    if epoch:
+        return datetime.datetime.utcfromtimestamp(int(epoch))
+    build_number = GetOption('build_number')
+    if build_number:
+        try:
+            return datetime.datetime.strptime(build_number, "%Y%m%d%H%M")
+        except ValueError:
+            pass
+    return None
+
+
+# Return the build info fields that do not change from one build to the
+# next. The build time and the default build number are only included
+# when they are stable (see GetStableBuildTime); otherwise they are left
+# out of the build info, as the time the build info was last written at
+# would be reported as the build time of binaries built long after.
+def GetBuildInfoStable(env):
     try:
         build_user = getpass.getuser()
     except KeyError:
@@ -219,25 +550,53 @@ def GetBuildInfoData(env, target, source):
     except KeyError:
         build_host = "unknown"
 
-    # Fetch Time in UTC
-    build_time = datetime.datetime.utcnow()
-
     build_version = GetBuildVersion(env)
     build_number = GetOption('build_number')
+    build_time = GetStableBuildTime()
 
-    # build json string containing build information
     info = {
         'build-version': build_version,
-        'build-time': str(build_time),
         'build-user': build_user,
         'build-hostname': build_host,
         'build-id': build_version,
-        'build-number': build_number if build_number else _build_number
     }
+    if build_time:
+        info['build-time'] = str(build_time)
+    if build_number:
+        info['build-number'] = build_number
+    elif build_time:
+        info['build-number'] = build_time.strftime("%Y%m%d%H%M")
+    return json.dumps(info, sort_keys=True)
+
+
+def GetBuildInfoData(env, target, source):
+    if source and isinstance(source[0], SCons.Node.Python.Value):
+        stable = json.loads(source[0].read())
+    else:
+        stable = json.loads(GetBuildInfoStable(env))
+
+    # build json string containing build information
+    fields = ['build-version', 'build-time', 'build-user', 'build-hostname',
+              'build-id', 'build-number']
+    info = dict((f, stable[f]) for f in fields if f in stable)
 
     return json.dumps({'build-info': [info]})
 
 
+# Write a build info file generated at SConscript read time, unless it
+# already has the same code.
+def WriteBuildInfoFile(env, path, code, comment):
+    stamp = comment % hashlib.sha1(code.encode()).hexdigest()
+    try:
+        with open(path) as f:
+            if f.readline().rstrip('\n') == stamp:
+                return
+    except OSError:
+        pass
+    with open(path, 'w') as f:
+        f.write(stamp + '\n' + code)
+
+
 def BuildInfoAction(env, target, source):
     build_dir = target[0].dir.path
     jsdata = GetBuildInfoData(env, target, source)
@@ -282,14 +641,12 @@ def GenerateBuildInfoCCode(env, target, source, path):
 const char *ContrailBuildInfo = "%(json)s";
 """ % {'json': jsdata.replace('"', "\\\"")}
 
-    with open(os.path.join(build_dir, target[0]), 'w') as c_file:
-        c_file.write(c_code)
+    WriteBuildInfoFile(env, os.path.join(build_dir, target[0]), c_code, '/* %s */')
 
 
 def GenerateBuildInfoPyCode(env, target, source, path):
     py_code = "build_info = '" + GetBuildInfoData(env, target, source) + "'"
-    with open(path + '/buildinfo.py', 'w') as py_file:
-        py_file.write(py_code)
+    WriteBuildInfoFile(env, path + '/buildinfo.py', py_code, '# %s')
 
     return target
 
@@ -306,7 +663,7 @@ def ExtractCppFunc(env, filelist):
         ext = fname.rsplit('.', 1)[1]
         if ext == 'cpp' or ext == 'cc':
             CppSrcs.append(fname)
-    return CppSrcs
+    return UnitySources(env, CppSrcs, '.cc')
 
 
 def ExtractCFunc(env, filelist):
@@ -316,7 +673,58 @@ def ExtractCFunc(env, filelist):
         ext = fname.rsplit('.', 1)[1]
         if ext == 'c':
             CSrcs.append(fname)
-    return CSrcs
+    return UnitySources(env, CSrcs, '.c')
+
+
+def WriteUnitySource(target, source, env):
+    with open(target[0].abspath, 'w') as f:
+        f.write('/*\n * Autogenerated file. DO NOT EDIT.\n */\n')
+        for path in json.loads(source[0].read()):
+            f.write('#include "%s"\n' % path)
+
+
+# With --unity=N, replace the sources by generated unity sources, each
+# including up to N of them, so that the headers they share are parsed
+# once per unity source instead of once per file. Sources matching a
+# --unity-exclude pattern, or a pattern in $UNITY_EXCLUDE, are returned
+# as they are. Unity sources are scanned like any other, so a change in
+# one of the included sources, or in a header they use, rebuilds the
+# unity object. Sources are grouped in the order given, per directory.
+# Source names are relative to the SConscript dir, like the unity source
+# names returned.
+def UnitySources(env, srcs, suffix):
+    size = GetOption('unity')
+    if not size or size < 2:
+        return srcs
+
+    excludes = (GetOption('unity_exclude') or []) + env.Flatten(env.get('UNITY_EXCLUDE', []))
+    result = []
+    groups = {}
+    for fname in srcs:
+        node = env.File(fname)
+        if any(fnmatch.fnmatch(fname, p) or fnmatch.fnmatch(node.name, p) for p in excludes):
+            result.append(fname)
+        else:
+            groups.setdefault(node.dir, []).append((fname, node))
+
+    cwd = env.Dir('.').abspath
+    for directory, files in groups.items():
+        for i in range(0, len(files), size):
+            chunk = files[i:i + size]
+            if len(chunk) == 1:
+                result.append(chunk[0][0])
+                continue
+            nodes = [node for _, node in chunk]
+            # with duplicate=0, sources are only in the source dir
+            paths = [n.abspath if n.has_builder() else n.srcnode().abspath for n in nodes]
+            digest = hashlib.sha1('\n'.join(paths).encode()).hexdigest()[:12]
+            unity = env.Command(directory.File('unity_%s%s' % (digest, suffix)),
+                                env.Value(json.dumps(paths)),
+                                Action(WriteUnitySource, 'Unity $TARGET'))
+            # generated sources must exist before the unity source is compiled
+            env.Requires(unity, nodes)
+            result.append(os.path.relpath(unity[0].abspath, cwd))
+    return result
 
 
 def ExtractHeaderFunc(env, filelist):
@@ -340,33 +748,302 @@ def ExtractHeaderFunc(env, filelist):
 # get scons to recognize the dependency on the sandesh compailer have
 # so far been fruitless.
 #
+# The check is a barrier shared by all builders: once a given sandesh
+# binary (identified by its inode, size and mtime) answered, later calls
+# only stat it and return. Concurrent callers wait for the first one.
+#
+_sandesh_ready = set()
+_sandesh_ready_lock = threading.Lock()
+
+
+def sandesh_install_signature(sandesh):
+    try:
+        st = os.stat(sandesh)
+    except OSError:
+        return None
+    return (sandesh, st.st_ino, st.st_size, st.st_mtime_ns)
+
+
 def wait_for_sandesh_install(env):
-    rc = 0
-    while (rc != 1):
-        with open(os.devnull, "w") as f:
+    if sandesh_install_signature(env['SANDESH']) in _sandesh_ready:
+        return
+
+    with _sandesh_ready_lock:
+        if sandesh_install_signature(env['SANDESH']) in _sandesh_ready:
+            return
+        rc = 0
+        while (rc != 1):
+            with open(os.devnull, "w") as f:
+                try:
+                    rc = subprocess.call([env['SANDESH'], '-version'], stdout=f, stderr=f)
+                except Exception:
+                    rc = 0
+            if rc != 1:
+                print('scons: warning: sandesh -version returned %d, retrying' % rc)
+                time.sleep(1)
+        _sandesh_ready.add(sandesh_install_signature(env['SANDESH']))
+
+
+# Sandesh builders accept batched calls: with --sandesh-batch, all calls
+# of a Sandesh builder made with the same construction environment (in
+# practice, from the same SConscript) and the same number of targets are
+# handled by a single action. The sandesh compiler takes one input file
+# per invocation, so the action runs the compiler for every file of the
+# batch concurrently. Targets of every call are tracked as before.
+def SandeshBatchKey(action, env, target, source):
+    if not GetOption('sandesh_batch'):
+        return None
+    return (action.execfunction, id(env), len(target))
+
+
+# Split the targets of a (possibly batched) Sandesh builder call per
+# source. Every batched call has the same number of targets.
+def SandeshBatches(target, source):
+    n = len(target) // len(source)
+    return [(target[i * n:(i + 1) * n], s) for i, s in enumerate(source)]
+
+
+# Create a scratch directory for the compiler output of every job under
+# the given directories, and remove them when done.
+@contextlib.contextmanager
+def SandeshScratchDirs(dirs):
+    scratch_dirs = []
+    try:
+        for d in dirs:
+            scratch_dirs.append(tempfile.mkdtemp(prefix='.sandesh-', dir=d))
+        yield scratch_dirs
+    finally:
+        for scratch in scratch_dirs:
+            shutil.rmtree(scratch, ignore_errors=True)
+
+
+# Run the sandesh compiler for every job, without a shell, up to -j
+# invocations at a time. A job is (arguments, output option, output
+# directory, source node). When the sandesh cache is enabled, output of
+# previous runs with the same inputs is restored instead.
+# Every SCons job running a sandesh builder starts up to num_jobs compilers
+# in parallel; the compilers of all jobs share num_jobs slots, so that
+# -j N runs at most N of them and not N per job.
+_sandesh_slots = None
+_sandesh_slots_lock = threading.Lock()
+
+
+def SandeshSlots():
+    global _sandesh_slots
+    with _sandesh_slots_lock:
+        if _sandesh_slots is None:
+            _sandesh_slots = threading.BoundedSemaphore(GetOption('num_jobs'))
+    return _sandesh_slots
+
+
+def RunSandesh(env, jobs, error):
+    wait_for_sandesh_install(env)
+    cache = getattr(env, 'sandesh_cache', None)
+
+    def run(job):
+        args, out_flag, out_dir, src = job
+        key = None
+        if cache:
+            key = cache.key(env, args + [out_flag], src)
+            if cache.restore(key, out_dir):
+                return 0
+        with SandeshSlots():
+            code = subprocess.call([env['SANDESH']] + args + [out_flag, out_dir, src.path])
+        if code == 0 and key:
+            cache.store(key, out_dir)
+        return code
+
+    workers = min(len(jobs), GetOption('num_jobs'))
+    if workers > 1:
+        with concurrent.futures.ThreadPoolExecutor(workers) as pool:
+            codes = list(pool.map(run, jobs))
+    else:
+        codes = [run(job) for job in jobs]
+    if any(codes):
+        raise SCons.Errors.StopError(SandeshCodeGeneratorError, error)
+
+
+# Total size of the files under path, in bytes.
+def DirSize(path):
+    size = 0
+    for root, _, files in os.walk(path):
+        size += sum(os.path.getsize(os.path.join(root, f)) for f in files)
+    return size
+
+
+# Evict the least recently used entries, directories matching ??/*, of the
+# cache in path while it is larger than max_size bytes. added is the
+# number of bytes this build stored, None if not known. The size found by
+# the last walk of the cache is kept in path/size, so the cache is only
+# walked again when that size plus what was added since could exceed
+# max_size.
+def TrimCacheDir(path, max_size, added=None):
+    if added == 0:
+        return
+    stamp = os.path.join(path, 'size')
+    total = None
+    if added is not None:
+        try:
+            with open(stamp) as f:
+                total = int(f.read()) + added
+        except (OSError, ValueError):
+            pass
+
+    if total is None or total > max_size:
+        entries = []
+        total = 0
+        for d in glob.glob(os.path.join(path, '??', '*')):
+            if d.endswith('.tmp'):
+                continue
             try:
-                rc = subprocess.call([env['SANDESH'], '-version'], stdout=f, stderr=f)
-            except Exception:
-                rc = 0
-        if rc != 1:
-            print('scons: warning: sandesh -version returned %d, retrying' % rc)
-            time.sleep(1)
+                size = DirSize(d)
+                entries.append((os.path.getmtime(d), size, d))
+            except OSError:
+                continue
+            total += size
+        entries.sort()
+        while total > max_size and entries:
+            _, size, d = entries.pop(0)
+            shutil.rmtree(d, ignore_errors=True)
+            total -= size
+
+    try:
+        with open(stamp + '.tmp', 'w') as f:
+            f.write('%d\n' % total)
+        os.replace(stamp + '.tmp', stamp)
+    except OSError:
+        pass
+
+
+class SandeshCache(object):
+    """Content-addressed cache of sandesh compiler output
+
+    Entries are keyed by the sandesh compiler binary, the generator
+    arguments, the source file path and content, and the content of all
+    files it includes, transitively. Paths are relative to the top
+    directory, so that workspaces at other places share the entries. An
+    entry is a copy of the directory the compiler wrote. Entries are touched when used, and the least
+    recently used ones are evicted when the cache grows over max_size
+    bytes at the end of the build.
+    """
+
+    include_re = re.compile(r'^\s*include\s+"([^"]+)"', re.MULTILINE)
+
+    def __init__(self, path, max_size):
+        self.path = path
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.added = 0
+        self.lock = threading.Lock()
+        # path -> (stat signature, content digest, included names)
+        self.files = {}
+        # compiler stat signature -> content digest
+        self.compilers = {}
+
+    def scan(self, path):
+        st = os.stat(path)
+        sig = (st.st_ino, st.st_size, st.st_mtime_ns)
+        with self.lock:
+            if path in self.files and self.files[path][0] == sig:
+                return self.files[path][1:]
+        with open(path, 'rb') as f:
+            content = f.read()
+        digest = hashlib.sha256(content).hexdigest()
+        includes = self.include_re.findall(content.decode(errors='replace'))
+        with self.lock:
+            self.files[path] = (sig, digest, includes)
+        return digest, includes
+
+    def key(self, env, args, source):
+        sandesh = env['SANDESH']
+        sig = sandesh_install_signature(sandesh)
+        if sig not in self.compilers:
+            with open(sandesh, 'rb') as f:
+                self.compilers[sig] = hashlib.sha256(f.read()).hexdigest()
+
+        h = hashlib.sha256()
+        h.update(json.dumps([self.compilers[sig], args, source.path]).encode())
+        top = env.Dir('#').abspath
+        search_path = [source.dir.abspath] + [d for d in SANDESH_INCLUDES if d != '-I']
+        pending = [source.abspath]
+        seen = set()
+        while pending:
+            path = pending.pop()
+            if path in seen:
+                continue
+            seen.add(path)
+            digest, includes = self.scan(path)
+            h.update((os.path.relpath(path, top) + ':' + digest + '\n').encode())
+            for name in includes:
+                for d in search_path:
+                    candidate = os.path.join(d, name)
+                    if os.path.isfile(candidate):
+                        pending.append(os.path.abspath(candidate))
+                        break
+                else:
+                    h.update(('missing:' + name + '\n').encode())
+        return h.hexdigest()
+
+    def entry(self, key):
+        return os.path.join(self.path, key[:2], key)
+
+    def restore(self, key, out_dir):
+        entry = self.entry(key)
+        try:
+            shutil.copytree(entry, out_dir, dirs_exist_ok=True)
+            os.utime(entry)
+        except OSError:
+            with self.lock:
+                self.misses += 1
+            return False
+        with self.lock:
+            self.hits += 1
+        return True
+
+    def store(self, key, out_dir):
+        entry = self.entry(key)
+        tmp = entry + '.%d.%d.tmp' % (os.getpid(), threading.get_ident())
+        try:
+            shutil.copytree(out_dir, tmp)
+            size = DirSize(tmp)
+            os.rename(tmp, entry)
+        except OSError:
+            # another build stored the same entry meanwhile
+            shutil.rmtree(tmp, ignore_errors=True)
+            return
+        with self.lock:
+            self.added += size
+
+    def trim(self):
+        TrimCacheDir(self.path, self.max_size, self.added)
+
+    def finish(self):
+        if self.hits + self.misses:
+            print('scons: sandesh cache: %d hits, %d misses (%.1f%% hit rate)' % (
+                self.hits, self.misses, 100.0 * self.hits / (self.hits + self.misses)))
+        self.trim()
+
+
+SANDESH_INCLUDES = ['-I', 'controller/src/', '-I', 'src/contrail-common']
 
 
 # SandeshGenDoc Methods
 def SandeshDocBuilder(target, source, env):
-    opath = target[0].dir.path
-    wait_for_sandesh_install(env)
-    code = subprocess.call(
-        env['SANDESH'] + ' --gen doc -I controller/src/ -I src/contrail-common -out ' +
-        opath + " " + source[0].path, shell=True)
-    if code != 0:
-        raise SCons.Errors.StopError(SandeshCodeGeneratorError,
-                                     'SandeshDoc documentation generation failed')
+    batches = SandeshBatches(target, source)
+    with SandeshScratchDirs([targets[0].dir.path for targets, _ in batches]) as scratch_dirs:
+        jobs = []
+        for (targets, src), scratch in zip(batches, scratch_dirs):
+            jobs.append((['--gen', 'doc'] + SANDESH_INCLUDES, '-out', scratch, src))
+        RunSandesh(env, jobs, 'SandeshDoc documentation generation failed')
+
+        for (targets, src), scratch in zip(batches, scratch_dirs):
+            MoveTree(scratch, targets[0].dir.path)
 
 
 def SandeshSconsEnvDocFunc(env):
-    docbuild = Builder(action=Action(SandeshDocBuilder, 'SandeshDocBuilder $SOURCE -> $TARGETS'))
+    docbuild = Builder(action=Action(SandeshDocBuilder, 'SandeshDocBuilder $SOURCES -> $TARGETS',
+                                     batch_key=SandeshBatchKey))
     env.Append(BUILDERS={'SandeshDoc': docbuild})
 
 
@@ -408,28 +1085,31 @@ def SandeshGenDocFunc(env, filepath, target=''):
     else:
         filename = path_split[0]
     targets = [target + 'gen-doc/' + filename + suffix for suffix in suffixes]
-    env.Depends(targets, '#build/bin/sandesh' + env['PROGSUFFIX'])
+    env.Depends(targets, env['TOP_BIN'] + '/sandesh' + env['PROGSUFFIX'])
     return env.SandeshDoc(targets, filepath)
 
 
 # SandeshGenOnlyCpp Methods
 def SandeshOnlyCppBuilder(target, source, env):
-    # file name w/o .sandesh
-    sname = os.path.splitext(source[0].name)[0]
-    html_cpp_name = os.path.join(target[0].dir.path, sname + '_html.cpp')
-
-    wait_for_sandesh_install(env)
-    code = subprocess.call(env['SANDESH'] + ' --gen cpp -I controller/src/ -I src/contrail-common -out ' +
-                           target[0].dir.path + " " + source[0].path, shell=True)
-    if code != 0:
-        raise SCons.Errors.StopError(SandeshCodeGeneratorError,
-                                     'SandeshOnlyCpp code generation failed')
-    with open(html_cpp_name, 'a') as html_cpp_file:
-        html_cpp_file.write('int ' + sname + '_marker = 0;\n')
+    batches = SandeshBatches(target, source)
+    with SandeshScratchDirs([targets[0].dir.path for targets, _ in batches]) as scratch_dirs:
+        jobs = []
+        for (targets, src), scratch in zip(batches, scratch_dirs):
+            jobs.append((['--gen', 'cpp'] + SANDESH_INCLUDES, '-out', scratch, src))
+        RunSandesh(env, jobs, 'SandeshOnlyCpp code generation failed')
+
+        for (targets, src), scratch in zip(batches, scratch_dirs):
+            # file name w/o .sandesh
+            sname = os.path.splitext(src.name)[0]
+            html_cpp_name = os.path.join(scratch, sname + '_html.cpp')
+            with open(html_cpp_name, 'a') as html_cpp_file:
+                html_cpp_file.write('int ' + sname + '_marker = 0;\n')
+            MoveTree(scratch, targets[0].dir.path)
 
 
 def SandeshSconsEnvOnlyCppFunc(env):
-    onlycppbuild = Builder(action=Action(SandeshOnlyCppBuilder, 'SandeshOnlyCppBuilder $SOURCE -> $TARGETS'))
+    onlycppbuild = Builder(action=Action(SandeshOnlyCppBuilder, 'SandeshOnlyCppBuilder $SOURCES -> $TARGETS',
+                                         batch_key=SandeshBatchKey))
     env.Append(BUILDERS={'SandeshOnlyCpp': onlycppbuild})
 
 
@@ -449,46 +1129,91 @@ def SandeshGenOnlyCppFunc(env, file, extra_suffixes=[]):
 
     basename = Basename(file)
     targets = [basename + suffix for suffix in suffixes]
-    env.Depends(targets, '#build/bin/sandesh' + env['PROGSUFFIX'])
+    env.Depends(targets, env['TOP_BIN'] + '/sandesh' + env['PROGSUFFIX'])
     return env.SandeshOnlyCpp(targets, file)
 
 
 # SandeshGenCpp Methods
+# The compiler writes to a scratch directory. <name>_html.cpp is then
+# assembled from the generated xml, embedded as a C array, and the html
+# template. Generated files are moved into place only when their content
+# changed (the targets are precious), so unchanged sandesh files do not
+# force recompilation of the files including or compiling them.
 def SandeshCppBuilder(target, source, env):
-    opath = target[0].dir.path
-    sname = os.path.join(opath, os.path.splitext(source[0].name)[0])
-
-    wait_for_sandesh_install(env)
-    code = subprocess.call(
-        env['SANDESH'] + ' --gen cpp --gen html -I controller/src/ -I src/contrail-common -out ' +
-        opath + " " + source[0].path, shell=True)
-    if code != 0:
-        raise SCons.Errors.StopError(SandeshCodeGeneratorError,
-                                     'SandeshCpp code generation failed')
-    tname = sname + "_html_template.cpp"
-    hname = os.path.basename(sname + ".xml")
-    cname = sname + "_html.cpp"
-    if not env.Detect('xxd'):
-        raise SCons.Errors.StopError(SandeshCodeGeneratorError,
-                                     'xxd not detected on system')
-    with open(cname, 'w') as cfile:
-        cfile.write('namespace {\n')
-
-    # If there's a need to get rid of shell redirection, one should
-    # get rid of calling xxd at all - this feature should be done in native Python code.
-    code = subprocess.call('xxd -i ' + hname + ' >> ' + os.path.basename(cname), shell=True, cwd=opath)
-    if code != 0:
-        raise SCons.Errors.StopError(SandeshCodeGeneratorError,
-                                     'xxd generation failed')
-    with open(cname, 'a') as cfile:
-        cfile.write('}\n')
-        with open(tname, 'r') as tfile:
-            for line in tfile:
-                cfile.write(line)
+    batches = SandeshBatches(target, source)
+    with SandeshScratchDirs([targets[0].dir.path for targets, _ in batches]) as scratch_dirs:
+        jobs = []
+        for (targets, src), scratch in zip(batches, scratch_dirs):
+            jobs.append((['--gen', 'cpp', '--gen', 'html'] + SANDESH_INCLUDES, '-out', scratch, src))
+        RunSandesh(env, jobs, 'SandeshCpp code generation failed')
+
+        for (targets, src), scratch in zip(batches, scratch_dirs):
+            opath = targets[0].dir.path
+            sname = os.path.join(scratch, os.path.splitext(src.name)[0])
+            hname = os.path.basename(sname + ".xml")
+            with open(sname + ".xml", 'rb') as hfile:
+                data = hfile.read()
+            with open(sname + "_html.cpp", 'wb') as cfile:
+                if env.get('SANDESH_EMBED') == 'incbin' and data:
+                    path = os.path.relpath(os.path.join(opath, hname), env.Dir('#build').path)
+                    cfile.write(IncbinArrayCode(hname, data, path))
+                else:
+                    cfile.write(b'namespace {\n')
+                    cfile.write(CArrayCode(hname, data))
+                    cfile.write(b'}\n')
+                with open(sname + "_html_template.cpp", 'rb') as tfile:
+                    cfile.write(tfile.read())
+            MoveTree(scratch, opath)
+
+
+# Return the same C code 'xxd -i' generates for a file with given name
+# and content: an unsigned char array and its length.
+def CArrayCode(name, data):
+    var = re.sub('[^0-9A-Za-z]', '_', name)
+    if var[0].isdigit():
+        var = '__' + var
+    lines = []
+    for i in range(0, len(data), 12):
+        lines.append('  ' + ', '.join('0x%02x' % b for b in data[i:i + 12]))
+    code = 'unsigned char %s[] = {\n' % var
+    if lines:
+        code += ',\n'.join(lines) + '\n'
+    code += '};\nunsigned int %s_len = %d;\n' % (var, len(data))
+    return code.encode()
+
+
+# Return C++ code exposing the same array and length as CArrayCode, with
+# the bytes pulled in by the assembler from path instead of a huge
+# initializer list the compiler has to parse. path is relative to the
+# build directory, which is on the assembler include path, so the code
+# does not depend on where the tree is checked out. The symbol is local to the
+# object file; its name contains a digest of the content, so the source
+# changes (and gets recompiled) whenever the embedded file does.
+def IncbinArrayCode(name, data, path):
+    var = re.sub('[^0-9A-Za-z]', '_', name)
+    if var[0].isdigit():
+        var = '__' + var
+    sym = 'sandesh_incbin_%s_%s' % (var, hashlib.sha1(data).hexdigest())
+    path = path.replace('\\', '\\\\').replace('"', '\\"')
+    asm = ['.section .rodata',
+           '.type %s, %%object' % sym,
+           '.size %s, %d' % (sym, len(data)),
+           '%s:' % sym,
+           '.incbin "%s"' % path,
+           '.previous']
+    asm = ['"%s\\n"' % line.replace('\\', '\\\\').replace('"', '\\"') for line in asm]
+    code = 'extern "C" unsigned char %s[%d];\n' % (sym, len(data))
+    code += '__asm__(\n    ' + '\n    '.join(asm) + ');\n'
+    code += 'namespace {\n'
+    code += 'unsigned char (&%s)[%d] = %s;\n' % (var, len(data), sym)
+    code += 'unsigned int %s_len = %d;\n' % (var, len(data))
+    code += '}\n'
+    return code.encode()
 
 
 def SandeshSconsEnvCppFunc(env):
-    cppbuild = Builder(action=Action(SandeshCppBuilder, 'SandeshCppBuilder $SOURCE -> $TARGETS'))
+    cppbuild = Builder(action=Action(SandeshCppBuilder, 'SandeshCppBuilder $SOURCES -> $TARGETS',
+                                     varlist=['SANDESH_EMBED'], batch_key=SandeshBatchKey))
     env.Append(BUILDERS={'SandeshCpp': cppbuild})
 
 
@@ -508,24 +1233,30 @@ def SandeshGenCppFunc(env, file, extra_suffixes=[]):
 
     basename = Basename(file)
     targets = [basename + suffix for suffix in suffixes]
-    env.Depends(targets, '#build/bin/sandesh' + env['PROGSUFFIX'])
+    env.Depends(targets, env['TOP_BIN'] + '/sandesh' + env['PROGSUFFIX'])
+    # SandeshCppBuilder rewrites only targets whose content changed
+    env.Precious(targets)
     return env.SandeshCpp(targets, file)
 
 
 # SandeshGenC Methods
 def SandeshCBuilder(target, source, env):
+    batches = SandeshBatches(target, source)
     # We need to trim the /gen-c/ out of the target path
-    opath = os.path.dirname(target[0].dir.path)
-    wait_for_sandesh_install(env)
-    code = subprocess.call(env['SANDESH'] + ' --gen c -o ' + opath +
-                           ' ' + source[0].path, shell=True)
-    if code != 0:
-        raise SCons.Errors.StopError(SandeshCodeGeneratorError,
-                                     'SandeshC code generation failed')
+    opaths = [os.path.dirname(targets[0].dir.path) for targets, _ in batches]
+    with SandeshScratchDirs(opaths) as scratch_dirs:
+        jobs = []
+        for (targets, src), scratch in zip(batches, scratch_dirs):
+            jobs.append((['--gen', 'c'], '-o', scratch, src))
+        RunSandesh(env, jobs, 'SandeshC code generation failed')
+
+        for opath, scratch in zip(opaths, scratch_dirs):
+            MoveTree(scratch, opath)
 
 
 def SandeshSconsEnvCFunc(env):
-    cbuild = Builder(action=Action(SandeshCBuilder, 'SandeshCBuilder $SOURCE -> $TARGETS'))
+    cbuild = Builder(action=Action(SandeshCBuilder, 'SandeshCBuilder $SOURCES -> $TARGETS',
+                                   batch_key=SandeshBatchKey))
     env.Append(BUILDERS={'SandeshC': cbuild})
 
 
@@ -534,29 +1265,55 @@ def SandeshGenCFunc(env, file):
     suffixes = ['_types.h', '_types.c']
     basename = Basename(file)
     targets = ['gen-c/' + basename + suffix for suffix in suffixes]
-    env.Depends(targets, '#build/bin/sandesh' + env['PROGSUFFIX'])
+    env.Depends(targets, env['TOP_BIN'] + '/sandesh' + env['PROGSUFFIX'])
     return env.SandeshC(targets, file)
 
 
 # SandeshGenPy Methods
+# The py and html generators are run in a single compiler pass. They
+# need different output directories: py modules go to <py_opath>/<module>/
+# and html files to <opath>. So the compiler writes to a scratch directory
+# and its output is moved into place: directories (py modules) under
+# py_opath and plain files (html) into opath.
 def SandeshPyBuilder(target, source, env):
-    opath = target[0].dir.path
-    py_opath = os.path.dirname(opath)
-    wait_for_sandesh_install(env)
-    code = subprocess.call(env['SANDESH'] + ' --gen py:new_style -I controller/src/ -I src/contrail-common -out ' +
-                           py_opath + " " + source[0].path, shell=True)
-    if code != 0:
-        raise SCons.Errors.StopError(SandeshCodeGeneratorError,
-                                     'SandeshPy py code generation failed')
-    code = subprocess.call(env['SANDESH'] + ' --gen html -I controller/src/ -I src/contrail-common -out ' +
-                           opath + " " + source[0].path, shell=True)
-    if code != 0:
-        raise SCons.Errors.StopError(SandeshCodeGeneratorError,
-                                     'SandeshPy html generation failed')
+    batches = SandeshBatches(target, source)
+    py_opaths = [os.path.dirname(targets[0].dir.path) for targets, _ in batches]
+    with SandeshScratchDirs(py_opaths) as scratch_dirs:
+        jobs = []
+        for (targets, src), scratch in zip(batches, scratch_dirs):
+            jobs.append((['--gen', 'py:new_style', '--gen', 'html'] + SANDESH_INCLUDES,
+                         '-out', scratch, src))
+        RunSandesh(env, jobs, 'SandeshPy code generation failed')
+
+        for (targets, src), scratch in zip(batches, scratch_dirs):
+            opath = targets[0].dir.path
+            py_opath = os.path.dirname(opath)
+            for name in os.listdir(scratch):
+                path = os.path.join(scratch, name)
+                if os.path.isdir(path):
+                    MoveTree(path, os.path.join(py_opath, name))
+                else:
+                    os.replace(path, os.path.join(opath, name))
+
+
+# Move the content of directory src into directory dst. Existing files
+# with the same content are left untouched, to keep their timestamps.
+def MoveTree(src, dst):
+    os.makedirs(dst, exist_ok=True)
+    for name in os.listdir(src):
+        path = os.path.join(src, name)
+        dst_path = os.path.join(dst, name)
+        if os.path.isdir(path) and not os.path.islink(path):
+            MoveTree(path, dst_path)
+        elif os.path.isfile(dst_path) and filecmp.cmp(path, dst_path, shallow=False):
+            os.unlink(path)
+        else:
+            os.replace(path, dst_path)
 
 
 def SandeshSconsEnvPyFunc(env):
-    pybuild = Builder(action=Action(SandeshPyBuilder, 'SandeshPyBuilder $SOURCE -> $TARGETS'))
+    pybuild = Builder(action=Action(SandeshPyBuilder, 'SandeshPyBuilder $SOURCES -> $TARGETS',
+                                    batch_key=SandeshBatchKey))
     env.Append(BUILDERS={'SandeshPy': pybuild})
 
 
@@ -578,7 +1335,7 @@ def SandeshGenPyFunc(env, path, target='', gen_py=True):
     else:
         targets = [target + mod_dir + module for module in modules]
 
-    env.Depends(targets, '#build/bin/sandesh' + env['PROGSUFFIX'])
+    env.Depends(targets, env['TOP_BIN'] + '/sandesh' + env['PROGSUFFIX'])
     return env.SandeshPy(targets, path)
 
 
@@ -617,25 +1374,45 @@ def IFMapBuilderCmd(source, target, env, for_signature):
     return '%s -f -g ifmap-backend -o %s %s' % (env.File('#src/contrail-api-client/generateds/generateDS.py').abspath, output, source[0])
 
 
+# Included schema paths of an XSD file, relative to the file, keyed by
+# the path and content signature of the file.
+_xsd_includes_cache = {}
+_xsd_include_re = re.compile(
+    r'<(?:[\w.-]+:)?include\b[^>]*?\bschemaLocation\s*=\s*["\']([^"\']+)["\']')
+
+
+# Return the schemaLocation of the includes of an XSD file node. Generated
+# schemas are not there yet when SConscripts are read, and are skipped.
+# A node in a variant dir is read from its source dir, where it is with
+# duplicate=0.
+def XsdIncludes(node):
+    if node.has_builder():
+        return []
+    src = node.srcnode().rfile()
+    if src.has_builder() or not os.path.isfile(src.abspath):
+        return []
+    key = (src.abspath, src.get_csig())
+    if key not in _xsd_includes_cache:
+        with open(src.abspath, errors='replace') as fh:
+            _xsd_includes_cache[key] = _xsd_include_re.findall(fh.read())
+    return _xsd_includes_cache[key]
+
+
+# Return the XSD file node with all the schemas it includes, transitively.
+def XsdScan(env, node):
+    nodes = [node]
+    seen = set([node.abspath])
+    for n in nodes:
+        for path in XsdIncludes(n):
+            inc = env.File(os.path.join(os.path.dirname(n.abspath), path))
+            if inc.abspath not in seen:
+                seen.add(inc.abspath)
+                nodes.append(inc)
+    return nodes
+
+
 def IFMapTargetGen(target, source, env):
-    sources = [source[0]]
-    dirname = os.path.dirname(source[0].abspath)
-    with open(source[0]) as fh:
-        for l in fh:
-            if "xsd:include" not in l:
-                continue
-            isl = l.find("schemaLocation=")
-            if isl == -1:
-                continue
-            i = l.find('"', isl)
-            i = i if i != -1 else l.find("'", isl)
-            if i == -1:
-                continue
-            j = l.find('"', i+1)
-            j = j if j != -1 else l.find("'", i+1)
-            if j == -1:
-                continue
-            sources.append(env.File(os.path.join(dirname, l[i+1:j])))
+    sources = XsdScan(env, source[0])
 
     suffixes = ['_types.h', '_types.cc', '_parser.cc',
                 '_server.cc', '_agent.cc']
@@ -681,15 +1458,85 @@ def CreateTypeBuilder(env):
     env.Append(BUILDERS={'TypeAutogen': builder})
 
 
+# GenerateDSAutogen runs several generateDS backends on a schema in one
+# process. The backends are taken from GENERATEDS_BACKENDS, e.g.
+#   env.GenerateDSAutogen(target, 'foo.xsd',
+#                         GENERATEDS_BACKENDS=['ifmap-backend', 'device-api'])
+# The targets of the ifmap-backend and type backends are emitted; as with
+# DeviceAPIAutogen, the device-api targets are given by the caller. The
+# ifmap-backend and type backends write the same files, so they cannot be
+# combined. With --generateds-batch, all calls made with the same
+# construction environment and number of targets share a single process.
+_generateds_targets = {
+    'ifmap-backend': ['_types.h', '_types.cc', '_parser.cc', '_server.cc', '_agent.cc'],
+    'type': ['_types.h', '_types.cc', '_parser.cc'],
+}
+
+
+def GenerateDSBatchKey(action, env, target, source):
+    if not GetOption('generateds_batch'):
+        return None
+    return (action.execfunction, id(env), len(target))
+
+
+def GenerateDSBuilder(target, source, env):
+    generateds = env.File('#src/contrail-api-client/generateds/generateDS.py').abspath
+    driver = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'generateds_multi.py')
+    cmd = [sys.executable, driver, generateds]
+    for targets, src in SandeshBatches(target, source):
+        # The source may be read from the source dir, the outputs go next
+        # to the targets; the last ones are emitted, the first may be given.
+        output = os.path.join(targets[-1].dir.abspath, Basename(src.name))
+        for backend in env['GENERATEDS_BACKENDS']:
+            cmd += ['-f', '-g', backend, '-o', output, src.path, '--']
+    if subprocess.call(cmd):
+        raise SCons.Errors.StopError(SandeshCodeGeneratorError,
+                                    'generateDS code generation failed')
+
+
+def GenerateDSTargetGen(target, source, env):
+    backends = env['GENERATEDS_BACKENDS']
+    if 'ifmap-backend' in backends and 'type' in backends:
+        raise SCons.Errors.UserError(
+            'GenerateDSAutogen: ifmap-backend and type backends write the same files')
+    targets = list(target) if 'device-api' in backends else []
+    basename = Basename(source[0].abspath)
+    for backend in backends:
+        targets += [basename + x for x in _generateds_targets.get(backend, [])]
+    # Included schemas are dependencies rather than sources, so that the
+    # sources of a batched action are exactly one schema per call.
+    env.Depends(targets, XsdScan(env, source[0])[1:])
+    return targets, source
+
+
+def CreateGenerateDSBuilder(env):
+    env.SetDefault(GENERATEDS_BACKENDS=['ifmap-backend', 'device-api'])
+    builder = Builder(action=Action(GenerateDSBuilder, 'GenerateDS $SOURCES -> $TARGETS',
+                                    varlist=['GENERATEDS_BACKENDS'],
+                                    batch_key=GenerateDSBatchKey),
+                      src_suffix='.xsd',
+                      emitter=GenerateDSTargetGen)
+    env.Append(BUILDERS={'GenerateDSAutogen': builder})
+
+
 # Check for unsupported/buggy compilers.
 def CheckBuildConfiguration(conf):
     # gcc 4.7.0 generates buggy code when optimization is turned on.
     opt_level = GetOption('opt')
-    if ((opt_level == 'production' or opt_level == 'profile') and
+    if ((opt_level == 'production' or opt_level == 'profile' or opt_level == 'pgo') and
             (conf.env['CC'].endswith("gcc") or conf.env['CC'].endswith("g++")) and
             conf.env['CCVERSION'] == "4.7.0"):
         print("Unsupported/Buggy compiler gcc 4.7.0 for building optimized binaries")
         raise convert_to_BuildError(1)
+    # Split debug info relies on -dumpbase naming the .dwo files after the
+    # objects, which gcc does as of version 11.
+    if GetOption('debug_info') == 'split':
+        version = conf.env.get('CCVERSION') or ''
+        if (not conf.env['CC'].endswith("gcc") or
+                int(version.split('.')[0] or 0) < 11):
+            print("Unsupported compiler %s %s for --debug-info=split, gcc 11 or later "
+                  "is needed" % (conf.env['CC'], version))
+            raise convert_to_BuildError(1)
     # Specific versions of MS C++ compiler are not supported for
     # "production" build.
     if opt_level == 'production' and conf.env['CC'] == 'cl':
@@ -726,6 +1573,277 @@ def CppEnableExceptions(env):
         env.Replace(CCFLAGS=cflags)
 
 
+C_SUFFIXES = ['.c']
+CXX_SUFFIXES = ['.cpp', '.cc', '.cxx', '.c++', '.C++', '.C']
+
+
+# Chain emitter after the emitters of the StaticObject and SharedObject
+# builders for the given source suffixes. The object builders are shared
+# by all environments, so this is done once per emitter, and the emitters
+# must check env for whether they apply. The object emitters of SCons
+# have run before, and have set target[0].attributes.shared.
+def AddObjectEmitter(env, emitter, suffixes):
+    for name in ('StaticObject', 'SharedObject'):
+        builder = env['BUILDERS'][name]
+        for suffix in suffixes:
+            current = builder.emitter.get(suffix)
+            chained = getattr(current, 'chained', ())
+            if current is None or emitter in chained:
+                continue
+            combined = SCons.Builder.ListEmitter([current, emitter])
+            combined.chained = chained + (emitter,)
+            builder.add_emitter(suffix, combined)
+
+
+# Make the C++ objects built with env depend on the precompiled header in
+# $PCH (static objects) or $SHPCH (shared objects), if any.
+def PchEmitter(target, source, env):
+    shared = getattr(target[0].attributes, 'shared', None)
+    pch = env.get('SHPCH' if shared else 'PCH')
+    if pch:
+        env.Depends(target, pch)
+    return target, source
+
+
+# With --debug-info=split, the compiler writes the debug info of every
+# object to $TARGET.dwo; make it known to SCons so it is cleaned.
+def DwoEmitter(target, source, env):
+    if env.get('DEBUG_INFO') == 'split':
+        env.SideEffect(target[0].abspath + '.dwo', target[0])
+    return target, source
+
+
+class DepfileCache(object):
+    """Persistent cache of parsed compiler depfiles
+
+    With --depfile-scan, every object is compiled with -MMD, writing the
+    headers it included to $TARGET.d. The dependencies of a depfile are
+    stored in path with the depfile size and modification time, so a
+    depfile is only parsed again when it was rewritten by a compilation.
+    A depfile older than one of its dependencies, the source among them,
+    may miss headers included since, and is not used.
+    The dependencies are relative to top, where the compiler runs, and not
+    to the directory of the SConscript being read.
+    """
+
+    _token_re = re.compile(r'(?:\\.|[^\s\\])+')
+
+    def __init__(self, path, top):
+        self.path = path
+        self.top = top
+        self.depfiles = {}
+        self.mtimes = {}
+        self.nodes = {}
+        self.modified = False
+        if os.path.exists(path):
+            try:
+                with open(path) as f:
+                    self.depfiles = json.load(f)
+            except (OSError, ValueError) as e:
+                print('scons: warning: ignoring depfile cache %s: %s' % (path, e))
+
+    @classmethod
+    def parse(cls, text):
+        tokens = cls._token_re.findall(text.replace('\\\n', ' '))
+        deps = []
+        for token in tokens[1:]:
+            token = token.replace('\\ ', ' ').replace('$$', '$')
+            if not token.endswith(':'):
+                deps.append(token)
+        return deps
+
+    def deps(self, depfile):
+        """Return the dependencies listed in depfile, None if it is missing,
+        or lists a file that no longer exists or was modified since."""
+        try:
+            st = os.stat(depfile)
+        except OSError:
+            return None
+        stamp = [st.st_size, st.st_mtime_ns]
+        entry = self.depfiles.get(depfile)
+        if entry is None or entry[:2] != stamp:
+            with open(depfile) as f:
+                entry = stamp + [self.parse(f.read())]
+            self.depfiles[depfile] = entry
+            self.modified = True
+        for dep in entry[2]:
+            mtime = self.mtimes.get(dep)
+            if mtime is None:
+                try:
+                    mtime = os.stat(os.path.join(self.top, dep)).st_mtime_ns
+                except OSError:
+                    return None
+                self.mtimes[dep] = mtime
+            if mtime >= st.st_mtime_ns:
+                return None
+        return entry[2]
+
+    def node(self, env, dep):
+        """Return the File node of dep, relative to the top directory."""
+        node = self.nodes.get(dep)
+        if node is None:
+            node = self.nodes[dep] = env.fs.Top.File(dep)
+        return node
+
+    def save(self):
+        if not self.modified:
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path + '.tmp', 'w') as f:
+            json.dump(self.depfiles, f)
+        os.replace(self.path + '.tmp', self.path)
+        self.modified = False
+
+
+# Make the files listed in the depfile of obj its implicit dependencies,
+# as --implicit-cache does with the stored ones, so SCons does not scan
+# its sources. Followed by the implicit dependencies of the compile
+# command (the compiler), in the order of a scan. Returns False, leaving
+# the sources to the C scanner, if the depfile is missing, or lists a file
+# that no longer exists or was modified since.
+def SetDepfileImplicit(env, obj, sources):
+    cache = env.depfile_cache
+    deps = cache.deps(obj.abspath + '.d')
+    if deps is None:
+        return False
+    nodes = [cache.node(env, dep) for dep in deps]
+    builder = env['BUILDERS']['SharedObject' if getattr(obj.attributes, 'shared', None)
+                              else 'StaticObject']
+    action = builder.cmdgen.get(sources[0].get_suffix())
+    if action is not None:
+        nodes += action.get_implicit_deps([obj], sources, env)
+    obj.implicit = []
+    obj.implicit_set = set()
+    # the depfile lists the sources as read, in the source dir with duplicate=0
+    own = set(sources) | set(s.srcnode() for s in sources)
+    obj._add_child(obj.implicit, obj.implicit_set, [n for n in nodes if n not in own])
+    obj._children_reset()
+    return True
+
+
+# With --depfile-scan, objects depend on the headers listed in the depfile
+# of their last compilation, when none of them nor the source changed
+# since. Otherwise a header may have been added, which may have to be
+# generated first, and objects are scanned as before, like the objects
+# not compiled yet.
+def DepfileEmitter(target, source, env):
+    if env.get('DEPFILE_SCAN'):
+        env.SideEffect(target[0].abspath + '.d', target[0])
+        if os.path.exists(target[0].abspath):
+            SetDepfileImplicit(env, target[0], source)
+    return target, source
+
+
+# Run after every compilation, so the dependencies stored for the object
+# are the ones of the depfile, as in the next build, and not those found
+# by the C scanner, which would rebuild it once more.
+def DepfileUpdate(target, source, env):
+    if env.get('DEPFILE_SCAN'):
+        SetDepfileImplicit(env, target[0], source)
+    return 0
+
+
+# Compile C and C++ objects with -MMD, and take their header dependencies
+# from the depfiles written by the compiler instead of scanning the
+# sources with the SCons C preprocessor scanner. -MMD leaves out system
+# headers, which SCons does not find in CPPPATH either.
+def SetupDepfileScan(env):
+    env['DEPFILE_SCAN'] = True
+    env.depfile_cache = DepfileCache(env.Dir('#build').abspath + '/depfile_cache.json',
+                                     env.Dir('#').abspath)
+    atexit.register(env.depfile_cache.save)
+    env.Append(CCFLAGS=['-MMD', '-MF', '${TARGET}.d'])
+    AddObjectEmitter(env, DepfileEmitter, C_SUFFIXES + CXX_SUFFIXES)
+    update = Action(DepfileUpdate, None)
+    for name in ('StaticObject', 'SharedObject'):
+        builder = env['BUILDERS'][name]
+        for suffix in C_SUFFIXES + CXX_SUFFIXES:
+            action = builder.cmdgen.get(suffix)
+            if action is not None:
+                builder.add_action(suffix, Action([action, update]))
+
+
+def WritePchWrapper(target, source, env):
+    with open(target[0].abspath, 'w') as f:
+        f.write('#include "%s"\n' % source[0].abspath)
+
+
+# Precompile header for all the C++ objects built with env, e.g.
+#   libenv = env.Clone()
+#   libenv.CppPrecompiledHeader('pch.h')
+#   libenv.Library('foo', sources)
+# Static and shared objects are compiled with different flags, so each
+# gets its own precompiled copy of the header, built with the flags of
+# env from a wrapper header (pch.h.pch/static/pch.h, .../shared/pch.h)
+# that is force-included in every C++ compilation. A precompiled header
+# is rebuilt when the headers it includes or the compiler flags change,
+# and the objects are rebuilt when it is.
+def CppPrecompiledHeader(env, header):
+    header = env.File(header)
+    AddObjectEmitter(env, PchEmitter, CXX_SUFFIXES)
+    variants = [
+        ('PCH', 'PCHFLAGS', 'CXXCOM', 'static',
+         '$CXX -o $TARGET -x c++-header -c $CXXFLAGS $CCFLAGS $_CCCOMCOM $SOURCE', '$PCHCOMSTR'),
+        ('SHPCH', 'SHPCHFLAGS', 'SHCXXCOM', 'shared',
+         '$SHCXX -o $TARGET -x c++-header -c $SHCXXFLAGS $SHCCFLAGS $_CCCOMCOM $SOURCE', '$SHPCHCOMSTR'),
+    ]
+    pchs = []
+    for var, flags_var, com_var, kind, cmd, cmdstr in variants:
+        wrapper = env.Command('%s.pch/%s/%s' % (header.abspath, kind, header.name), header,
+                              Action(WritePchWrapper, None))
+        env[var] = env.Command(wrapper[0].abspath + '.gch', wrapper, Action(cmd, cmdstr),
+                               source_scanner=SCons.Tool.CScanner)
+        env[flags_var] = ['-include', wrapper[0].abspath, '-Winvalid-pch']
+        if '$' + flags_var not in env[com_var]:
+            env[com_var] = env[com_var] + ' $' + flags_var
+        pchs += env[var]
+    return pchs
+
+
+# -march/-mtune value of every --cpu
+CPU_MARCH = {
+    'native': 'native',
+    'hsw': 'haswell',
+    'snb': 'sandybridge',
+    'ivb': 'ivybridge',
+}
+
+
+# Build a shared library as env.SharedLibrary does and, with --multi-isa,
+# a copy of it for each of the given x86-64 ISA levels, in
+# glibc-hwcaps/<level>/ next to it. The dynamic loader (glibc 2.33 or
+# later) loads the copy for the best level the CPU supports, so hot
+# libraries run at full speed on newer hardware and still run on older
+# one. The variants are listed in the isa_variants attribute of the
+# library node, see InstallMultiIsa. Only sources are rebuilt for the
+# variants; objects and libraries given as sources are used as they are.
+def MultiIsaSharedLibrary(env, target, source, **kw):
+    lib = env.SharedLibrary(target, source, **kw)
+    levels = GetOption('multi_isa')
+    lib[0].attributes.isa_variants = []
+    if not levels or env['CPU_TYPE']:
+        return lib
+    for level in levels.split(','):
+        venv = env.Clone()
+        venv.Append(CCFLAGS='-march=' + level)
+        venv['SHOBJSUFFIX'] = '.%s%s' % (level, env['SHOBJSUFFIX'])
+        vtarget = lib[0].dir.Dir('glibc-hwcaps').Dir(level).File(lib[0].name)
+        variant = venv.SharedLibrary(vtarget, source, **kw)
+        lib[0].attributes.isa_variants.append((level, variant))
+    return lib
+
+
+# Install shared libraries in dir, with the ISA variants built by
+# MultiIsaSharedLibrary in dir/glibc-hwcaps/<level>/.
+def InstallMultiIsa(env, dir, libs):
+    installed = env.Install(dir, libs)
+    for lib in env.Flatten([libs]):
+        lib = env.arg2nodes(lib)[0]
+        for level, variant in getattr(lib.attributes, 'isa_variants', []):
+            installed += env.Install(os.path.join(str(dir), 'glibc-hwcaps', level), variant)
+    return installed
+
+
 # Decide whether to use parallel build, and determine value to use/set.
 # Controlled by environment var CONTRAIL_BUILD_JOBS:
 #    if set to 'no' or 1, then no parallel build
@@ -759,6 +1877,273 @@ def determine_job_value():
     return avail
 
 
+# Return MemAvailable from /proc/meminfo in kB, None if unknown.
+def GetAvailableMemory():
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1])
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+class MemoryAwareScheduler(object):
+    """Memory-aware gate for the commands run by the build
+
+    With --memory-aware-jobs, every command SCons spawns goes through
+    spawn(), which delays it while starting it could overcommit memory.
+    A command is started when fewer commands of its class (compile, link
+    or codegen) than the limit for that class are running, and the
+    expected peak RSS of all running commands plus its own fits in the
+    memory available when the build started. At least one command always
+    runs, so an action larger than the budget still makes progress.
+
+    The expected peak RSS of a command is the one measured by peak_rss.py
+    when it last ran, identified by its output file, or a per-class
+    default. Peaks are remembered across builds in path.
+    """
+
+    # Expected peak RSS, in kB, of commands that were never measured.
+    default_rss = {'compile': 512 * 1024, 'link': 2048 * 1024, 'codegen': 256 * 1024}
+    # Memory left for the rest of the system, in kB.
+    reserve = 512 * 1024
+
+    def __init__(self, path, limits, budget):
+        self.path = path
+        self.limits = limits
+        self.budget = budget
+        self.peaks = {}
+        self.running = dict((c, 0) for c in self.default_rss)
+        self.committed = 0
+        self.cond = threading.Condition()
+        self.modified = False
+        if os.path.exists(path):
+            try:
+                with open(path) as f:
+                    self.peaks = json.load(f)
+            except (OSError, ValueError) as e:
+                print('scons: warning: ignoring action memory usage %s: %s' % (path, e))
+
+    @staticmethod
+    def classify(args):
+        tool = os.path.basename(args[0]) if args else ''
+        if '-c' in args or '-S' in args or '-E' in args:
+            return 'compile'
+        if re.search(r'(^|-)(g\+\+|gcc|c\+\+|cc|clang\+\+|clang|ld(\.\w+)?)$', tool):
+            return 'link'
+        return 'codegen'
+
+    @staticmethod
+    def output(args):
+        for i, arg in enumerate(args[:-1]):
+            if arg == '-o':
+                return args[i + 1].strip('"\'')
+        return hashlib.sha1(' '.join(args).encode()).hexdigest()
+
+    def acquire(self, cls, rss):
+        with self.cond:
+            while self.committed and (
+                    self.running[cls] >= self.limits[cls] or
+                    self.committed + rss > self.budget):
+                self.cond.wait()
+            self.running[cls] += 1
+            self.committed += rss
+
+    def release(self, cls, rss):
+        with self.cond:
+            self.running[cls] -= 1
+            self.committed -= rss
+            self.cond.notify_all()
+
+    def spawn(self, sh, escape, cmd, args, env):
+        cls = self.classify(args)
+        key = self.output(args)
+        rss = min(self.peaks.get(key, self.default_rss[cls]), self.budget)
+        self.acquire(cls, rss)
+        rss_path = '%s.%d.%d.rss' % (self.path, os.getpid(), threading.get_ident())
+        try:
+            # Same as the posix SCons spawn, but through peak_rss.py to
+            # learn the peak RSS of the shell and the processes it waited
+            # for.
+            cmd = PeakRssCommand([sh, '-c', ' '.join(args)], rss_path)
+            code = subprocess.call(cmd, env=env, close_fds=True)
+        finally:
+            self.release(cls, rss)
+        peak = ReadPeakRss(rss_path)
+        if code == 0 and peak is not None:
+            with self.cond:
+                self.peaks[key] = peak
+                self.modified = True
+        return code
+
+    def save(self):
+        with self.cond:
+            if not self.modified:
+                return
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path + '.tmp', 'w') as f:
+                json.dump(self.peaks, f, indent=0, sort_keys=True)
+            os.replace(self.path + '.tmp', self.path)
+            self.modified = False
+
+
+class BuildTrace(object):
+    """Per-action build trace in Chrome trace event format
+
+    With --trace-file, the start and end time, worker thread and exit
+    status of every action SCons executes are recorded, and written at
+    the end of the build as a Chrome trace JSON file that can be loaded in
+    Perfetto or chrome://tracing. Only timestamps and node references are
+    kept while building; names are resolved when the trace is written.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.events = []
+        self.slots = {}
+        self.lock = threading.Lock()
+        self.origin = time.time()
+
+    def install(self):
+        task_class = SCons.Script.Main.BuildTask
+        execute = task_class.execute
+        trace = self
+
+        def traced_execute(task):
+            start = time.time()
+            status = 0
+            try:
+                execute(task)
+            except SCons.Errors.BuildError as e:
+                status = e.status or 1
+                raise
+            except BaseException:
+                status = 1
+                raise
+            finally:
+                trace.record(task.targets, start, time.time(), status)
+        task_class.execute = traced_execute
+
+    def record(self, targets, start, end, status):
+        node = targets[0]
+        # executors are released once built, keep what names are made of
+        executor = node.get_executor()
+        actions = executor.get_action_list() if executor else []
+        thread = threading.get_ident()
+        with self.lock:
+            slot = self.slots.setdefault(thread, len(self.slots))
+            self.events.append((targets, node.get_builder(), node.get_env(), actions,
+                                start, end, slot, status))
+
+    @staticmethod
+    def action_name(builder, env, actions):
+        name = builder.get_name(env) if builder is not None else 'None'
+        if not name.startswith('<'):
+            return name
+        # builders of env.Command() and the like have no name, use the action
+        for action in actions:
+            function = getattr(action, 'execfunction', None) or getattr(action, 'generator', None)
+            if function is not None:
+                return getattr(function, '__name__', type(function).__name__)
+            cmd = getattr(action, 'cmd_list', None)
+            if cmd:
+                cmd = cmd if isinstance(cmd, str) else ' '.join(str(c) for c in cmd)
+                # e.g. $CXX, named after the tool it expands to
+                words = (env.subst(cmd, SCons.Subst.SUBST_SIG) if env is not None else cmd).split()
+                if words:
+                    return os.path.basename(words[0])
+        return 'Command'
+
+    def save(self):
+        events = []
+        for targets, builder, env, actions, start, end, slot, status in self.events:
+            if isinstance(targets[0], Alias.Alias) and not actions:
+                continue
+            events.append({
+                'name': str(targets[0]),
+                'cat': self.action_name(builder, env, actions),
+                'ph': 'X',
+                'ts': int((start - self.origin) * 1e6),
+                'dur': int((end - start) * 1e6),
+                'pid': 1,
+                'tid': slot,
+                'args': {'targets': [str(t) for t in targets], 'status': status},
+            })
+        for slot in sorted(self.slots.values()):
+            events.append({'name': 'thread_name', 'ph': 'M', 'pid': 1, 'tid': slot,
+                           'args': {'name': 'job %d' % slot}})
+        dirname = os.path.dirname(self.path)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        with open(self.path, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+
+
+# Run C and C++ compilations of env through compiler_cache.py, caching
+# object files in the --compiler-cache directory. The wrapper is excluded
+# from the command signatures, so turning the cache on or off does not
+# cause rebuilds.
+def SetupCompilerCache(env):
+    cache_dir = os.path.abspath(GetOption('compiler_cache'))
+    max_size = GetOption('compiler_cache_size') * 1024 * 1024
+    stats = env.Dir('#build').abspath + '/compiler_cache_stats'
+    os.makedirs(os.path.dirname(stats), exist_ok=True)
+    open(stats, 'w').close()
+
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'compiler_cache.py')
+    env['COMPILER_CACHE'] = [sys.executable, script, '--dir', cache_dir, '--stats', stats, '--']
+    for var in ('CCCOM', 'CXXCOM', 'SHCCCOM', 'SHCXXCOM'):
+        env[var] = '$( $COMPILER_CACHE $) ' + env[var]
+
+    def finish():
+        hits = misses = added = 0
+        with open(stats) as f:
+            for line in f:
+                fields = line.split()
+                if fields == ['hit']:
+                    hits += 1
+                elif fields == ['miss']:
+                    misses += 1
+                elif len(fields) == 2 and fields[0] == 'stored':
+                    added += int(fields[1])
+        if hits + misses:
+            print('scons: compiler cache: %d hits, %d misses (%.1f%% hit rate)' % (
+                hits, misses, 100.0 * hits / (hits + misses)))
+        TrimCacheDir(cache_dir, max_size, added)
+    atexit.register(finish)
+
+
+# Install the memory-aware scheduler as the SPAWN function of env, and of
+# every environment cloned from it.
+def SetupMemoryAwareJobs(env):
+    nj = GetOption('num_jobs')
+    if nj == 1:
+        nj = multiprocessing.cpu_count()
+        SetOption('num_jobs', nj)
+        env['NUM_JOBS'] = nj
+    limits = {
+        'compile': GetOption('compile_jobs') or nj,
+        'link': GetOption('link_jobs') or max(1, nj // 4),
+        'codegen': GetOption('codegen_jobs') or nj,
+    }
+    available = GetAvailableMemory()
+    if available is None:
+        budget = float('inf')
+    else:
+        budget = max(available - MemoryAwareScheduler.reserve, 1)
+    path = env.Dir('#build').abspath + '/action_memory.json'
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    scheduler = MemoryAwareScheduler(path, limits, budget)
+    atexit.register(scheduler.save)
+    env['SPAWN'] = scheduler.spawn
+    print("scons: memory-aware jobs: -j%d, %s, %s MB available" % (
+        nj, ', '.join('%s %d' % (c, limits[c]) for c in sorted(limits)),
+        'unknown' if available is None else available // 1024))
+    return scheduler
+
+
 class UnitTestsCollector(object):
     """Unit Test collector and processor
 
@@ -777,6 +2162,135 @@ class UnitTestsCollector(object):
             "log_path": log_path}]
 
 
+class UnitTestTimings(object):
+    """Persistent unit test duration database
+
+    Remembers how long each unit test took when it last passed. TestSuite
+    uses it to start the longest tests first, and RunUnitTest derives the
+    test timeout from it. Tests are identified by the path of the test
+    binary relative to the top directory, so every build tree has its own
+    timings.
+    """
+
+    # Timeout of a test with known duration is this many times its duration,
+    # but never less than min_timeout seconds.
+    timeout_factor = 5
+    min_timeout = 120
+
+    def __init__(self, path):
+        self.path = path
+        self.timings = {}
+        self.lock = threading.Lock()
+        self.modified = False
+        if os.path.exists(path):
+            try:
+                with open(path) as f:
+                    self.timings = json.load(f)
+            except (OSError, ValueError) as e:
+                print('scons: warning: ignoring unit test timings %s: %s' % (path, e))
+
+    def get(self, test, default=None):
+        return self.timings.get(test, default)
+
+    def record(self, test, duration):
+        with self.lock:
+            self.timings[test] = duration
+            self.modified = True
+
+    def timeout(self, test, default, shards=1):
+        duration = self.get(test)
+        if duration is None:
+            return default
+        duration = duration / shards
+        return max(self.min_timeout, int(duration * self.timeout_factor) + 1)
+
+    def save(self):
+        with self.lock:
+            if not self.modified:
+                return
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path + '.tmp', 'w') as f:
+                json.dump(self.timings, f, indent=0, sort_keys=True)
+            os.replace(self.path + '.tmp', self.path)
+            self.modified = False
+
+
+class RepoProjects(collections.abc.Mapping):
+    """Mapping of project path to name from 'repo list'
+
+    'repo list' is only run when the mapping is first used, and its result
+    is cached in path until the .repo manifest or project list change.
+    Outside of a repo checkout, or when repo is missing, the mapping is
+    empty.
+    """
+
+    def __init__(self, top, path):
+        self.top = top
+        self.path = path
+        self.projects = None
+        self.lock = threading.Lock()
+
+    def __semi_deepcopy__(self):
+        # read-only, share it between cloned environments
+        return self
+
+    def signature(self):
+        sig = []
+        for name in ('manifest.xml', 'project.list'):
+            try:
+                sig.append(os.stat(os.path.join(self.top, '.repo', name)).st_mtime_ns)
+            except OSError:
+                sig.append(None)
+        return sig
+
+    def load(self):
+        sig = self.signature()
+        if sig == [None, None]:
+            return {}
+        try:
+            with open(self.path) as f:
+                cache = json.load(f)
+            if cache['signature'] == sig:
+                return cache['projects']
+        except (OSError, ValueError, LookupError, TypeError):
+            pass
+
+        if not find_executable('repo'):
+            print('scons: warning: repo not found in the PATH, REPO_PROJECTS is empty')
+            return {}
+        proc = subprocess.Popen(['repo', 'list'], cwd=self.top,
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        repo_out, _ = proc.communicate()
+        projects = {}
+        for line in repo_out.decode().splitlines():
+            (path, repo) = line.split(" : ")
+            projects[path] = repo
+        if proc.returncode == 0:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path + '.tmp', 'w') as f:
+                json.dump({'signature': sig, 'projects': projects}, f, indent=0, sort_keys=True)
+            os.replace(self.path + '.tmp', self.path)
+        return projects
+
+    def get_projects(self):
+        with self.lock:
+            if self.projects is None:
+                self.projects = self.load()
+            return self.projects
+
+    def __getitem__(self, key):
+        return self.get_projects()[key]
+
+    def __iter__(self):
+        return iter(self.get_projects())
+
+    def __len__(self):
+        return len(self.get_projects())
+
+    def __repr__(self):
+        return repr(self.get_projects())
+
+
 def EnsureBuildDependency(env, dependency):
     if not find_executable(dependency):
         raise BuildError(errstr='The \'{}\' utility was not found in the PATH.'.format(dependency))
@@ -785,8 +2299,15 @@ def EnsureBuildDependency(env, dependency):
 def SetupBuildEnvironment(conf):
     AddOption('--optimization', '--opt', dest='opt',
               action='store', default='debug',
-              choices=['debug', 'production', 'profile'],
-              help='optimization level: [debug|production|profile]')
+              choices=['debug', 'production', 'profile', 'pgo'],
+              help='optimization level: [debug|production|profile|pgo]')
+    AddOption('--pgo-phase', dest='pgo_phase', action='store',
+              choices=['generate', 'use'], default='use',
+              help='with --opt=pgo, build instrumented binaries that write '
+                   'profiles to build/pgo-profile (generate), or optimize with '
+                   'those profiles (use) [generate|use]')
+    AddOption('--lto', dest='lto', action='store_true', default=False,
+              help='enable link time optimization')
 
     AddOption('--coverage', dest='coverage',
               action='store_true',
@@ -799,7 +2320,15 @@ def SetupBuildEnvironment(conf):
 
     AddOption('--cpu', dest='cpu',
               action='store',
-              choices=['native', 'hsw', 'snb', 'ivb'])
+              choices=['native', 'hsw', 'snb', 'ivb'],
+              help='build for the given x86-64 CPU, in build/<opt>-<cpu>, '
+                   'with its libraries and binaries in build/lib-<cpu> and '
+                   'build/bin-<cpu>')
+    AddOption('--multi-isa', dest='multi_isa', action='store',
+              metavar='LEVELS', default=None,
+              help='also build the libraries of MultiIsaSharedLibrary for the '
+                   'comma-separated x86-64 ISA levels in LEVELS (x86-64-v2, '
+                   'x86-64-v3, x86-64-v4), picked at run time by glibc-hwcaps')
 
     AddOption('--root', dest='install_root', action='store')
     AddOption('--prefix', dest='install_prefix', action='store')
@@ -807,22 +2336,109 @@ def SetupBuildEnvironment(conf):
     AddOption('--without-dpdk', dest='without-dpdk',
               action='store_true', default=False)
     AddOption('--skip-tests', dest='skip_tests', action='store', default=None)
+    AddOption('--cache-test-results', dest='cache_test_results',
+              action='store_true', default=False,
+              help='do not re-run unit tests which passed with the same '
+                   'binary, libraries and environment')
+    AddOption('--test-cache-size', dest='test_cache_size', action='store',
+              type='int', metavar='MB', default=1024,
+              help='maximum size of the unit test result cache in megabytes')
+    AddOption('--shard-tests', dest='shard_tests', action='store',
+              type='int', default=0, metavar='SECONDS',
+              help='split gtest binaries into parallel shards of about SECONDS '
+                   'each, based on their recorded duration')
     AddOption('--describe-tests', dest='describe-tests',
               action='store_true', default=False)
     AddOption('--describe-aliases', dest='describe-aliases',
               action='store_true', default=False)
+    AddOption('--describe-critical-path', dest='describe-critical-path',
+              action='store', metavar='TRACE', default=None,
+              help='print the critical path of the targets, weighted by the '
+                   'action durations in TRACE (see --trace-file)')
+    AddOption('--sandesh-batch', dest='sandesh_batch',
+              action='store_true', default=False,
+              help='generate code for all sandesh files of a SConscript '
+                   'in one batched action')
+    AddOption('--generateds-batch', dest='generateds_batch',
+              action='store_true', default=False,
+              help='run generateDS for all schemas of a SConscript '
+                   'in one batched action')
+    AddOption('--sandesh-embed', dest='sandesh_embed',
+              action='store', default='array', choices=['array', 'incbin'],
+              help='embed sandesh xml into _html.cpp as a C array or with '
+                   'the assembler .incbin directive: [array|incbin]')
+    AddOption('--sandesh-cache', dest='sandesh_cache', action='store',
+              metavar='DIR', default=None,
+              help='reuse sandesh compiler output cached in DIR')
+    AddOption('--sandesh-cache-size', dest='sandesh_cache_size', action='store',
+              type='int', metavar='MB', default=2048,
+              help='maximum size of the sandesh cache in megabytes')
+    AddOption('--compiler-cache', dest='compiler_cache', action='store',
+              metavar='DIR', default=None,
+              help='reuse object files cached in DIR for identical compilations')
+    AddOption('--compiler-cache-size', dest='compiler_cache_size', action='store',
+              type='int', metavar='MB', default=10240,
+              help='maximum size of the compiler cache in megabytes')
+    AddOption('--depfile-scan', dest='depfile_scan', action='store_true',
+              default=False,
+              help='take the header dependencies of objects from the '
+                   'depfiles written by the compiler instead of scanning '
+                   'the sources')
+    AddOption('--unity', dest='unity', action='store', type='int',
+              metavar='N', default=0,
+              help='compile the sources of ExtractCpp/ExtractC in unity '
+                   'sources including up to N of them each')
+    AddOption('--unity-exclude', dest='unity_exclude', action='append',
+              metavar='PATTERN',
+              help='never merge sources matching PATTERN in unity sources')
+    AddOption('--debug-info', dest='debug_info', action='store',
+              choices=['full', 'split', 'none'], default=None,
+              help='debug info: in objects and binaries (full, the default '
+                   'unless CONTRAIL_COMPILE_WITHOUT_SYMBOLS is set), in '
+                   '.dwo files next to the objects (split, needs gcc 11 or '
+                   'later), or none '
+                   '[full|split|none]')
+    AddOption('--linker', dest='linker', action='store',
+              choices=['bfd', 'gold', 'lld', 'mold'], default=None,
+              help='link with the given linker, multi-threaded when supported '
+                   '[bfd|gold|lld|mold]')
     AddOption('--c++', '--cpp', '--std', dest='cpp_standard',
               action='store', default='c++17',
               choices=['c++98', 'c++11', 'c++14', 'c++17', 'c++2a'],
               help='C++ standard[c++98, c++11, c++14, c++17, c++2a]')
 
     AddOption('--build-number', dest='build_number', action='store')
+    AddOption('--trace-file', dest='trace_file', action='store',
+              metavar='FILE', default=None,
+              help='write a Chrome trace (Perfetto) of all build actions to FILE')
+    AddOption('--memory-aware-jobs', dest='memory_aware_jobs',
+              action='store_true', default=False,
+              help='delay build commands by available memory and the peak '
+                   'memory usage they had in previous builds')
+    AddOption('--compile-jobs', dest='compile_jobs', action='store',
+              type='int', metavar='N', default=None,
+              help='with --memory-aware-jobs, run at most N compilations at once')
+    AddOption('--link-jobs', dest='link_jobs', action='store',
+              type='int', metavar='N', default=None,
+              help='with --memory-aware-jobs, run at most N links at once')
+    AddOption('--codegen-jobs', dest='codegen_jobs', action='store',
+              type='int', metavar='N', default=None,
+              help='with --memory-aware-jobs, run at most N other commands '
+                   '(code generators, archivers, ...) at once')
 
     env = CheckBuildConfiguration(conf)
 
+    trace_file = GetOption('trace_file')
+    if trace_file:
+        env.build_trace = BuildTrace(os.path.abspath(trace_file))
+        env.build_trace.install()
+        atexit.register(env.build_trace.save)
+
     # Let's decide how many jobs (-jNN) we should use.
     nj = GetOption('num_jobs')
-    if nj == 1:
+    if GetOption('memory_aware_jobs'):
+        env.job_scheduler = SetupMemoryAwareJobs(env)
+    elif nj == 1:
         # Should probably check for CLI over-ride of -j1 (i.e., do not
         # assume 1 means -j not specified).
         nj = determine_job_value()
@@ -873,30 +2489,55 @@ def SetupBuildEnvironment(conf):
     env['TOP_INCLUDE'] = '#build/include'
     env['TOP_LIB'] = '#build/lib'
 
+    if env['CPU_TYPE']:
+        # the CPU types are x86-64 ones
+        if (env.get('TARGET_MACHINE') != 'x86_64' or
+                platform.machine().startswith(('arm', 'aarch64'))):
+            raise SCons.Errors.UserError('--cpu is only supported for x86_64 targets')
+        march = CPU_MARCH[env['CPU_TYPE']]
+        env.Append(CCFLAGS=['-march=' + march, '-mtune=' + march])
+        env.Append(LINKFLAGS=['-march=' + march, '-mtune=' + march])
+        # every CPU gets its own binaries and libraries
+        env['TOP_BIN'] += '-' + env['CPU_TYPE']
+        env['TOP_LIB'] += '-' + env['CPU_TYPE']
+
     pytest = GetOption('pytest')
     if pytest:
         env['PYTESTARG'] = pytest
     else:
         env['PYTESTARG'] = None
     env.tests = UnitTestsCollector()
+    env.test_timings = UnitTestTimings(env.Dir('#build').abspath + '/unittest_timings.json')
+    atexit.register(env.test_timings.save)
+    if GetOption('cache_test_results'):
+        atexit.register(TrimUnitTestCache, env.Dir('#build/test-cache').abspath,
+                        GetOption('test_cache_size') * 1024 * 1024)
 
     # Store path to sandesh compiler in the env
     env['SANDESH'] = os.path.join(env.Dir(env['TOP_BIN']).path, 'sandesh' + env['PROGSUFFIX'])
+    env['SANDESH_EMBED'] = GetOption('sandesh_embed')
+    if env['SANDESH_EMBED'] == 'incbin':
+        # .incbin paths of the generated sources; not in the signatures,
+        # as it does not change what gets compiled
+        env.Append(CCFLAGS=['$(', '-Wa,-I' + env.Dir('#build').path, '$)'])
+    sandesh_cache = GetOption('sandesh_cache')
+    if sandesh_cache:
+        env.sandesh_cache = SandeshCache(os.path.abspath(sandesh_cache),
+                                         GetOption('sandesh_cache_size') * 1024 * 1024)
+        atexit.register(env.sandesh_cache.finish)
+
+    if GetOption('compiler_cache'):
+        SetupCompilerCache(env)
+    if GetOption('depfile_scan'):
+        SetupDepfileScan(env)
 
     # Store the hostname in env.
     if 'HOSTNAME' not in env:
         env['HOSTNAME'] = platform.node()
 
-    # Store repo projects in the environment
-    proc = subprocess.Popen('repo list', stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell='True')
-    repo_out, _ = proc.communicate()
-    repo_out = repo_out.decode()
-    repo_lines = repo_out.splitlines()
-    repo_list = {}
-    for line in repo_lines:
-        (path, repo) = line.split(" : ")
-        repo_list[path] = repo
-    env['REPO_PROJECTS'] = repo_list
+    # Store repo projects in the environment, looked up on first use
+    env['REPO_PROJECTS'] = RepoProjects(env.Dir('#').abspath,
+                                        env.Dir('#build').abspath + '/repo_projects.json')
 
     if env['CPP_STANDARD']:
         stdoption = '-std=' + env['CPP_STANDARD']
@@ -917,6 +2558,36 @@ def SetupBuildEnvironment(conf):
         env.Append(CCFLAGS=['-O3', '-DDEBUG', '-pg'])
         env.Append(LINKFLAGS=['-pg'])
         env['TOP'] = '#build/profile'
+    elif opt_level == 'pgo':
+        # Profile-guided optimization, see pgo.sh. Both phases build in
+        # the same TOP, so profiles are found under the object paths they
+        # were recorded for.
+        env.Append(CCFLAGS='-O3')
+        env['TOP'] = '#build/pgo'
+        env['PGO_PROFILE_DIR'] = env.Dir('#build/pgo-profile').abspath
+        if GetOption('pgo_phase') == 'generate':
+            # atomic counters as the daemons are multi-threaded
+            pgo_flags = ['-fprofile-generate=$PGO_PROFILE_DIR', '-fprofile-update=atomic']
+        else:
+            # code not run by the training workload is optimized as usual
+            pgo_flags = ['-fprofile-use=$PGO_PROFILE_DIR', '-fprofile-partial-training',
+                         '-Wno-missing-profile']
+        env.Append(CCFLAGS=pgo_flags)
+        env.Append(LINKFLAGS=pgo_flags)
+
+    if env['CPU_TYPE']:
+        # every CPU gets its own build tree
+        env['TOP'] += '-' + env['CPU_TYPE']
+
+    if GetOption('lto'):
+        env.Append(CCFLAGS='-flto=auto')
+        env.Append(LINKFLAGS='-flto=auto')
+        # archives of gcc LTO objects need the linker plugin for their
+        # index, e.g. gcc-ar-12 for gcc-12
+        gcc = re.match(r'(.*gcc)(-[\d.]+)?$', env['CC'])
+        if gcc:
+            env['AR'] = gcc.group(1) + '-ar' + (gcc.group(2) or '')
+            env['RANLIB'] = gcc.group(1) + '-ranlib' + (gcc.group(2) or '')
 
     if GetOption('coverage'):
         env.Append(CCFLAGS='--coverage')
@@ -924,9 +2595,38 @@ def SetupBuildEnvironment(conf):
         env.Append(LDFLAGS='--coverage')
         env.Append(LINKFLAGS='--coverage')
 
-    if "CONTRAIL_COMPILE_WITHOUT_SYMBOLS" not in os.environ:
+    debug_info = GetOption('debug_info')
+    if debug_info is None:
+        debug_info = 'none' if "CONTRAIL_COMPILE_WITHOUT_SYMBOLS" in os.environ else 'full'
+    env['DEBUG_INFO'] = debug_info
+    if debug_info != 'none':
         env.Append(CCFLAGS='-g')
         env.Append(LINKFLAGS='-g')
+    if debug_info == 'split':
+        # Debug info goes to $TARGET.dwo files next to the objects, and
+        # stays out of the objects and of what the linker has to process.
+        # -dumpbase names them after the object, as static and shared
+        # objects of a source would otherwise share the same .dwo. DWARF 4
+        # as gold --gdb-index and binutils dwp do not handle split DWARF 5.
+        env.Append(CCFLAGS=['-gsplit-dwarf', '-gdwarf-4', '-dumpbase', '$TARGET'])
+        AddObjectEmitter(env, DwoEmitter, C_SUFFIXES + CXX_SUFFIXES)
+
+    linker = GetOption('linker')
+    if linker:
+        env['LINKER'] = linker
+        env.Append(LINKFLAGS='-fuse-ld=' + linker)
+        threads = multiprocessing.cpu_count()
+        if linker == 'gold':
+            env.Append(LINKFLAGS=['-Wl,--threads', '-Wl,--thread-count=%d' % threads])
+        elif linker in ('lld', 'mold'):
+            env.Append(LINKFLAGS='-Wl,--threads=%d' % threads)
+    if debug_info == 'split':
+        if linker and linker != 'bfd':
+            # index for gdb to load symbols without reading all .dwo files
+            env.Append(LINKFLAGS='-Wl,--gdb-index')
+        else:
+            print("scons: warning: --debug-info=split without --linker=gold|lld|mold, "
+                  "linking without --gdb-index")
 
     env.Append(BUILDERS={'TestSuite': TestSuite})
     env.Append(BUILDERS={'UnitTest': UnitTest})
@@ -953,12 +2653,16 @@ def SetupBuildEnvironment(conf):
     CreateIFMapBuilder(env)
     CreateTypeBuilder(env)
     CreateDeviceAPIBuilder(env)
+    CreateGenerateDSBuilder(env)
 
     symlink_builder = Builder(action="cd ${TARGET.dir} && " +
                               "ln -s ${SOURCE.file} ${TARGET.file}")
     env.Append(BUILDERS={'Symlink': symlink_builder})
 
     env.AddMethod(CppEnableExceptions, "CppEnableExceptions")
+    env.AddMethod(CppPrecompiledHeader, "CppPrecompiledHeader")
+    env.AddMethod(MultiIsaSharedLibrary, "MultiIsaSharedLibrary")
+    env.AddMethod(InstallMultiIsa, "InstallMultiIsa")
 
     return env
 
@@ -1011,6 +2715,108 @@ def DescribeAliases():
         print(alias)
 
 
+def DescribeCriticalPath(env, targets, trace_path):
+    """Print the critical path of the given targets, and the achieved
+    parallelism, from a trace written by --trace-file.
+
+    The critical path is the longest chain of dependent actions, weighted
+    by the durations measured in the trace; actions that are not in the
+    trace (up to date, or not run) and the creation of directories weigh
+    nothing, and are not listed. No build can be shorter
+    than its critical path, so the actions on it are the ones whose
+    speedup shortens the wall-clock time.
+    """
+    with open(trace_path) as f:
+        events = [e for e in json.load(f)['traceEvents'] if e.get('ph') == 'X']
+    if not events:
+        print('No actions in %s' % trace_path)
+        return
+
+    # target path -> event of the action that built it
+    built_by = {}
+    for e in events:
+        for t in e['args']['targets']:
+            built_by[t] = e
+
+    def event(node):
+        if isinstance(node, SCons.Node.FS.Dir):
+            return None
+        return built_by.get(str(node))
+
+    def cost(node):
+        e = event(node)
+        return e['dur'] / 1e6 if e else 0.0
+
+    # longest path ending at every node, computed iteratively as the
+    # graph is far deeper than the Python recursion limit
+    longest = {}
+    longest_child = {}
+    roots = []
+    for t in targets or ['.']:
+        alias = Alias.default_ans.lookup(t)
+        roots.append(alias if alias else env.fs.Entry(t))
+    stack = [(n, False) for n in roots]
+    while stack:
+        node, expanded = stack.pop()
+        if node in longest:
+            continue
+        children = node.children()
+        if not expanded:
+            stack.append((node, True))
+            stack.extend((c, False) for c in children if c not in longest)
+            continue
+        best, best_child = 0.0, None
+        for c in children:
+            if longest.get(c, 0.0) > best or best_child is None:
+                best, best_child = longest.get(c, 0.0), c
+        longest[node] = best + cost(node)
+        longest_child[node] = best_child
+
+    path = []
+    node = max(roots, key=lambda n: longest[n])
+    total = longest[node]
+    while node is not None:
+        e = event(node)
+        if e and (not path or path[-1] is not e):
+            path.append(e)
+        node = longest_child.get(node)
+    path.reverse()
+
+    start = min(e['ts'] for e in events)
+    end = max(e['ts'] + e['dur'] for e in events)
+    wall = (end - start) / 1e6
+    busy = sum(e['dur'] for e in events) / 1e6
+
+    print('Critical path: %.1fs of %.1fs wall time, %d actions' % (total, wall, len(path)))
+    print('------------------------')
+    elapsed = 0.0
+    for e in path:
+        elapsed += e['dur'] / 1e6
+        print('%8.1fs %8.1fs  %s [%s]' % (e['dur'] / 1e6, elapsed, e['name'], e['cat']))
+
+    print('')
+    print('Parallelism: %.2f on average (%.1fs of actions in %.1fs)' % (
+        busy / wall if wall else 0.0, busy, wall))
+    print('------------------------')
+    buckets = 20
+    width = (end - start) / buckets or 1
+    for i in range(buckets):
+        lo = start + i * width
+        hi = lo + width
+        overlap = sum(max(0, min(hi, e['ts'] + e['dur']) - max(lo, e['ts'])) for e in events)
+        p = overlap / width
+        print('%8.1fs %6.2f %s' % ((lo - start) / 1e6, p, '#' * int(round(p * 4))))
+
+    print('')
+    print('Actions whose speedup would most shorten the build:')
+    print('------------------------')
+    # actions under 1% of the critical path would not make a difference
+    heavy = [e for e in path if total and e['dur'] / 1e6 / total >= 0.01]
+    for e in sorted(heavy, key=lambda e: -e['dur'])[:10]:
+        print('%8.1fs %5.1f%%  %s [%s]' % (e['dur'] / 1e6, 100.0 * e['dur'] / 1e6 / total,
+                                          e['name'], e['cat']))
+
+
 def AddPythonSources(env, path, excludes=[]) -> list:
     result = []
     for item in env.Glob(path + '/*'):
@@ -0,0 +1,115 @@
+#
+# Copyright (c) 2026 OpenSDN authors. Licensed under the Apache License,
+# Version 2.0, see LICENSE.
+#
+
+# Build tests of rules.py. Each test writes a small source tree, with
+# tools/build linked to this repository, and runs scons on it.
+
+import os
+import subprocess
+import sys
+
+import pytest
+
+pytest.importorskip('SCons')
+
+BUILD_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SCONSTRUCT = '''
+import os, sys
+sys.path.append('tools/build')
+import rules
+conf = Configure(DefaultEnvironment(ENV=os.environ))
+env = rules.SetupBuildEnvironment(conf)
+SConscript('src/SConscript', variant_dir=env['TOP'] + '/src', duplicate=0,
+           exports='env')
+'''
+
+
+def make_tree(root, files):
+    os.makedirs(os.path.join(root, 'tools'))
+    os.symlink(BUILD_DIR, os.path.join(root, 'tools', 'build'))
+    files = dict(files)
+    files.setdefault('SConstruct', SCONSTRUCT)
+    for name, content in files.items():
+        path = os.path.join(root, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            f.write(content)
+
+
+def scons(root, *args):
+    proc = subprocess.run([sys.executable, '-m', 'SCons', '-Q'] + list(args),
+                          cwd=str(root), stdout=subprocess.PIPE,
+                          stderr=subprocess.STDOUT, universal_newlines=True)
+    assert proc.returncode == 0, proc.stdout
+    return proc.stdout
+
+
+def test_unity_sources_in_subdirectory(tmp_path):
+    make_tree(str(tmp_path), {
+        'src/SConscript': (
+            "Import('env')\n"
+            "env.Program('prog', env.ExtractCpp(['a.cc', 'b.cc', 'main.cc']))\n"),
+        'src/a.cc': 'int a() { return 1; }\n',
+        'src/b.cc': 'int b() { return 2; }\n',
+        'src/main.cc': 'int a();\nint b();\nint main() { return a() + b() - 3; }\n',
+    })
+    scons(tmp_path, '--unity=3')
+
+    out = tmp_path / 'build' / 'debug' / 'src'
+    unity = list(out.glob('unity_*.cc'))
+    assert len(unity) == 1
+    for name in ('a.cc', 'b.cc', 'main.cc'):
+        assert '#include "%s"' % (tmp_path / 'src' / name) in unity[0].read_text()
+    subprocess.check_call([str(out / 'prog')])
+
+
+def test_depfile_scan_noop_build_does_not_scan(tmp_path):
+    # print the nodes the C scanner is called on
+    count_scans = (
+        "import SCons.Tool\n"
+        "scan = SCons.Tool.CScanner.function\n"
+        "def counting_scan(node, env, path, *args):\n"
+        "    print('C scan: %s' % node)\n"
+        "    return scan(node, env, path, *args)\n"
+        "SCons.Tool.CScanner.function = counting_scan\n")
+    make_tree(str(tmp_path), {
+        'SConstruct': count_scans + SCONSTRUCT,
+        'src/SConscript': (
+            "Import('env')\n"
+            "env.Append(CPPPATH=['#src/include'])\n"
+            "env.Program('prog', ['main.cc'])\n"),
+        'src/include/value.h': '#define VALUE 0\n',
+        'src/main.cc': '#include "value.h"\nint main() { return VALUE; }\n',
+    })
+    assert 'C scan:' in scons(tmp_path, '--depfile-scan')
+    out = scons(tmp_path, '--depfile-scan')
+    assert 'C scan:' not in out
+    assert 'is up to date' in out
+
+    # a changed header is still a dependency
+    (tmp_path / 'src' / 'include' / 'value.h').write_text('#define VALUE 1\n')
+    assert 'main.o' in scons(tmp_path, '--depfile-scan')
+
+
+def test_depfile_scan_new_generated_header(tmp_path):
+    make_tree(str(tmp_path), {
+        'src/SConscript': (
+            "Import('env')\n"
+            "env.Append(CPPPATH=['.'])\n"
+            "env.Program('prog', ['main.cc'])\n"),
+        'src/main.cc': 'int main() { return 0; }\n',
+    })
+    scons(tmp_path, '--depfile-scan')
+
+    # the source starts including a header generated in the build
+    with open(str(tmp_path / 'src' / 'SConscript'), 'a') as f:
+        f.write("env.Command('gen.h', [], 'echo \"#define VALUE 0\" > $TARGET')\n")
+    (tmp_path / 'src' / 'main.cc').write_text(
+        '#include "gen.h"\nint main() { return VALUE; }\n')
+    # the header is built only if known as a dependency of the object
+    prog = 'build/debug/src/prog'
+    scons(tmp_path, '-j4', '--depfile-scan', prog)
+    assert 'is up to date' in scons(tmp_path, '--depfile-scan', prog)